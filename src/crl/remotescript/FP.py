@@ -14,8 +14,14 @@ class FP(RemoteScript):
     library.
 
     Keywords defined in this library are: `Execute Command In Node`,
-    `Execute Background Command In Node`, `Execute Script In Node`,
-    `Execute Background Script In Node`, `Copy File To Node`, `Copy File From Node`
+    `Execute Command In Nodes`, `Execute Background Command In Node`, `Execute Script In Node`,
+    `Execute Background Script In Node`, `Copy File To Node`, `Copy File From Node`,
+    `Copy Directory To Node`, `Copy Directory From Node`
+
+    By default the nodes are accessed with ssh and scp commands executed
+    in the primary target. With target property _node transport_
+    \"direct\" the library connects to the nodes over the SSH connection
+    of the primary target instead, see `Set Target Property`.
     """
     @staticmethod
     def _engine_factory():
@@ -49,6 +55,41 @@ class FP(RemoteScript):
         """
         return self._engine.node_execute(node, command, target, exec_id, timeout)
 
+    def execute_command_in_nodes(self, nodes, command, target='default', exec_id='foreground',
+                                 timeout=None, max_parallel=10):
+        """
+        Executes command concurrently in several nodes accessed through a primary target.
+
+        Like keyword `Execute Command In Targets`, but executes the command
+        in named nodes like `Execute Command In Node`. The executions share
+        the connection to the primary target over up to 10 channels, so
+        more connections are opened only if _max_parallel_ is larger.
+
+        At most _max_parallel_ executions are running at the same time. This
+        call will block until the command has been executed in all the
+        nodes. Failure in one node does not abort the executions in the
+        other nodes, but it is reported in the returned results.
+
+        *Arguments:*\n
+        _nodes_: List of target nodes or string of comma separated target nodes.\n
+        _command_: Bash shell command to execute in the target nodes.\n
+        _target_: Primary target through which the target nodes are accessed.\n
+        _exec_id_: Connection ID prefix to use. Connection ID of each execution is \
+                _exec_id_-_node_.\n
+        _timeout_: Timeout for the command in each node in seconds.\n
+        _max_parallel_: Maximum number of concurrent executions.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.MultiResult.html|MultiResult] object mapping node \
+        names to [crl.remotescript.result.Result.html|Result] objects.
+
+        *Example:*\n
+        | testcase | ${results}=     | Execute Command In Nodes | node-1, node-2 | uptime |
+        |          | Should Be Empty | ${results.failed}        |                |        |
+        |          | Log             | ${results}               |                |        |
+        """
+        return self._engine.node_execute_in_nodes(nodes, command, target, exec_id, timeout, max_parallel)
+
     def node_background(self, node, command, target='default', exec_id='background'):
         """*DEPRECATED* Keyword has been renamed to `Execute Background Command In Node`."""
         self._engine.node_execute_background(node, command, target, exec_id)
@@ -97,7 +138,8 @@ class FP(RemoteScript):
         Target` keyword and from the primary target the script file is
         copied to the target node using scp command. The script file
         is then executed in the node. This call will block until the command
-        has been executed.
+        has been executed. With target property _script transfer_ \"stdin\"
+        the script is streamed to the node without copying.
 
         *Arguments:*\n
         _node_: Target node in which to execute the script file.\n
@@ -125,7 +167,9 @@ class FP(RemoteScript):
         primary target node using the procol specified with `Set
         Target` keyword and from the primary node the script file is
         copied to the target node using scp command. The script file
-        is then executed in the node.
+        is then executed in the node. With target property _script
+        transfer_ \"stdin\" the script is streamed to the node without
+        copying.
 
         This keyword returns immediately and the script is left
         running in the background. See `Wait Background Execution` on
@@ -155,6 +199,9 @@ class FP(RemoteScript):
         """
         Copy file from local host through primary target to the target node.
 
+        Over SSH targets the file is streamed to the node over one command
+        without a temporary copy in the target.
+
         *Arguments:*\n
         _node_: Target node where to copy the file to.\n
         _source_file_: Local source file.\n
@@ -181,6 +228,9 @@ class FP(RemoteScript):
         """
         Copy file from the node through primary target to local host.
 
+        Over SSH targets the file is streamed from the node over one command
+        without a temporary copy in the target.
+
         *Arguments:*\n
         _node_: Target node where to copy the file from.\n
         _source_file_: Source file in the node.\n
@@ -193,3 +243,68 @@ class FP(RemoteScript):
         [crl.remotescript.result.Result.html|Result] object.\n
         """
         return self._engine.node_get_file(node, source_file, destination, target, exec_id, timeout)
+
+    def copy_directory_to_node(self, node, source_dir, destination_dir='.', mode=oct(0o755),
+                               compression=None, target='default', exec_id='foreground', timeout=None):
+        """
+        Copy contents of local directory through primary target to the target node.
+
+        The directory is streamed as a tar archive through the primary target
+        to tar in the node over one command, so nothing is stored in the
+        primary target. Requires SSH connection to the primary target and
+        tar in the node.
+
+        *Arguments:*\n
+        _node_: Target node where to copy the directory to.\n
+        _source_dir_: Local source directory whose contents are copied to the node.\n
+        _destination_dir_: Remote destination directory in the node that will be \
+                created if missing.\n
+        _mode_: Access mode to set to the files and directories copied to the node.\n
+        _compression_: gzip compression level from 1 to 9 of the archive or 0 for \
+                no compression. By default the archive is compressed with level 6 if \
+                target property _directory transfer_ is \"tar.gz\".\n
+        _target_: Name of the target through which to copy the directory to the node.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout in seconds.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.Result.html|Result] object.\n
+
+        *Example:*\n
+        | testcase | Copy Directory To Node | node-1 | scripts | /tmp/scripts | compression=1 |
+        """
+        return self._engine.node_put_dir(
+            node, source_dir, destination_dir, mode, compression, target, exec_id, timeout)
+
+    def copy_directory_from_node(self, node, source_dir, destination_dir='.', include=None, exclude=None,
+                                 compression=None, target='default', exec_id='foreground', timeout=None):
+        """
+        Copy contents of directory in the node through primary target to local host.
+
+        The directory is archived with tar in the node and the archive is
+        streamed through the primary target over one command and extracted
+        locally as it arrives, so nothing is stored in the primary target.
+        The patterns are matched like in `Copy Directory From Target`.
+        Requires SSH connection to the primary target and tar in the node.
+
+        *Arguments:*\n
+        _node_: Target node where to copy the directory from.\n
+        _source_dir_: Source directory in the node whose contents are copied.\n
+        _destination_dir_: Local destination directory that will be created if missing.\n
+        _include_: Comma or space separated list of file name patterns to copy.\n
+        _exclude_: Comma or space separated list of file and directory name patterns to skip.\n
+        _compression_: gzip compression level from 1 to 9 of the archive or 0 for \
+                no compression. By default the archive is compressed with level 6 if \
+                target property _directory transfer_ is \"tar.gz\".\n
+        _target_: Name of the target through which to copy the directory from the node.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout in seconds.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.Result.html|Result] object.\n
+
+        *Example:*\n
+        | testcase | Copy Directory From Node | node-1 | /var/log | logs | include=*.log |
+        """
+        return self._engine.node_get_dir(
+            node, source_dir, destination_dir, include, exclude, compression, target, exec_id, timeout)
@@ -53,9 +53,14 @@ class RemoteScript(object):
     |       | Should Be Equal  | ${bg_result.stdout}       | Hello World          |
     """
     ROBOT_LIBRARY_SCOPE = 'TEST CASE'
+    ROBOT_LISTENER_API_VERSION = 2
 
     def __init__(self):
         self._engine = self._engine_factory()
+        self.ROBOT_LIBRARY_LISTENER = self  # pylint: disable=invalid-name
+
+    def _close(self):
+        self._engine.close()
 
     @staticmethod
     def _engine_factory():
@@ -124,16 +129,134 @@ class RemoteScript(object):
                 [crl.remotescript.result.Result.html|Result].connection_ok will be set to \
                 \"False\", exit status to \"unknown\", stdout and stderr will be empty \
                 strings | True |
+        | _connection idle timeout_ | Time in seconds a persistent connection may stay \
+                unused before it is closed. See _persistent connection_. | 300 |
+        | _copy mode_ | How `Copy File Between Targets` copies files from this target. \
+                \"relay\" reads the file to the local host and writes it to the \
+                destination target. \"direct\" runs scp in this target to copy the file \
+                straight to the destination target host and port using a temporary key \
+                authorized in the destination target for the duration of the copy. The key \
+                may only run scp receiving the copied file, which requires OpenSSH 7.2 or \
+                newer in the destination target. If the direct copy fails, the file is \
+                relayed. If the key cannot be removed after the copy, the keyword fails. | relay |
+        | _copy window_ | Number of bytes `Copy File Between Targets` reads ahead from \
+                the source target while writing to the destination target. Larger \
+                window helps on high latency links but uses more memory. | 4194304 |
+        | _directory transfer_ | How `Copy Directory To Target` transfers the files over \
+                SSH. \"file\" copies the files one by one, \"tar\" streams a tar archive \
+                of the directory to tar in the target over one command and \"tar.gz\" \
+                streams a gzip compressed archive. If tar is not available in the target, \
+                the files are copied one by one. With \"tar.gz\", `Copy Directory From \
+                Target` also compresses the archive. | file |
         | _login prompt_  | Telnet login prompt regular expression   | \"login: \" |
         | _login timeout_ | Timeout to wait login prompt in seconds. | 60 |
+        | _max channels per connection_ | Maximum number of concurrent executions sharing \
+                one SSH connection to the target. Each execution opens its own session \
+                channel over the shared connection. If all the connections are at the \
+                limit, a new connection is opened. Value 1 disables sharing. An idle \
+                SFTP session kept open for file transfers also uses one session of the \
+                connection. | 1 |
         | _max connection attempts_ | Maxmum nuber of reconnection attempts if connection \
                 is  refused | 10 |
+        | _max output size_ | Maximum number of bytes of stdout and stderr each kept in \
+                memory per execution. If the output exceeds the limit, it is handled as \
+                defined by _output overflow_. None means unlimited. | None |
+        | _node control master_ | In FP library, share one SSH connection from the target \
+                to each node and su user between the node keywords using an OpenSSH \
+                control master socket in _tempdir_ of the target. The control masters \
+                are stopped when the library goes out of scope. | False |
+        | _node control persist_ | In FP library, time in seconds an unused node control \
+                master stays open. | 600 |
+        | _node password_ | In FP library with _node transport_ \"direct\", password for \
+                logging in to the nodes. None means the su password of the target if \
+                su username is set and otherwise the password of the target. | None |
+        | _node port_ | In FP library with _node transport_ \"direct\", SSH port of the \
+                nodes. | 22 |
+        | _node ssh key file_ | In FP library with _node transport_ \"direct\", local SSH \
+                private key file for logging in to the nodes. None means the key file \
+                of the target. | None |
+        | _node transport_ | How FP library reaches the nodes. \"ssh\" runs ssh and scp \
+                commands in the target. \"direct\" opens SSH connection to the node over \
+                a direct-tcpip channel forwarded by the SSH connection to the target \
+                and runs the node keywords like the target keywords over it, without \
+                temporary files in the target and without the quoting restrictions. \
+                Requires SSH/SFTP target with TCP forwarding allowed. | \"ssh\" |
+        | _node username_ | In FP library with _node transport_ \"direct\", user for \
+                logging in to the nodes. None means the su username of the target if \
+                set as with \"ssh\" node transport and otherwise the user of the \
+                target. | None |
         | _nonzero status is error_ | Raise NonZeroExitStatusError if exit status of the \
                 command is not  zero. If set to 'True' and command fails  stdout and stderr \
                 are not returned, but they are included in the exception message | False |
+        | _output overflow_ | Handling of output exceeding _max output size_. \"truncate\" \
+                keeps the first and the last half of _max output size_ bytes and records \
+                the number of discarded bytes to \
+                [crl.remotescript.result.Result.html|Result].stdout_truncated and \
+                stderr_truncated. \"file\" writes the whole output to a local temporary \
+                file which is read when stdout or stderr is accessed and whose path is \
+                in stdout_file or stderr_file. The files are removed when the library \
+                goes out of scope. | \"truncate\" |
+        | _parallel transfer channels_ | Number of SFTP sessions `Copy File To Target` and \
+                `Copy File From Target` use concurrently for files of at least _parallel \
+                transfer threshold_ bytes. Each session counts as one session of the SSH \
+                connection. Value 1 disables parallel transfers. | 4 |
+        | _parallel transfer chunk size_ | Size in bytes of the byte ranges the parallel \
+                transfer sessions copy one at a time. | 8388608 |
+        | _parallel transfer threshold_ | Minimum file size in bytes copied over parallel \
+                SFTP sessions. The size and, if md5sum is available in the target, the MD5 \
+                checksum of the copy are verified after a parallel transfer. Value 0 \
+                disables parallel transfers. | 104857600 |
         | _password prompt_ | Telnet password prompt regular expression  | \"Password: \"  |
+        | _persistent connection_ | Keep SSH connection open after the keyword and reuse \
+                it in the following keywords using the same target host, port, credentials \
+                and su settings. Idle connections are checked before reuse and all the \
+                persistent connections are closed when the library goes out of scope. | False |
         | _port_            | Target port.       | 22 for ssh and 23 for telnet |
         | _prompt_          | Target prompt      | \"$ \" |
+        | _resume transfers_ | Continue `Copy File To Target` and `Copy File From Target` \
+                over SFTP from a partial destination file left by an earlier failed copy \
+                if its MD5 checksum equals the checksum of the same number of bytes at \
+                the beginning of the source file. If the connection breaks during the \
+                copy, the copy is resumed over a new connection at most _max connection \
+                attempts_ times. Requires head and md5sum in the target. | False |
+        | _script cache_ | Keep scripts executed with `Execute Script In Target` in \
+                _script cache dir_ in the target under the checksum of the script \
+                content. The script is copied only if it is not in the cache yet and it \
+                is executed in its cache directory. | False |
+        | _script cache dir_ | Target directory of the script cache. The directory \
+                must be owned by the user and not writable by others. Cached scripts \
+                are used only if they are owned by the user and their checksum matches. | \
+                \"/tmp/pdrobot-remotescript-cache\" |
+        | _script cache max age_ | When the library goes out of scope, cached scripts \
+                not used within this many seconds are removed. | 604800 |
+        | _script cache max size_ | When the library goes out of scope, the least \
+                recently used cached scripts are removed until the cache is smaller than \
+                this many bytes. | 104857600 |
+        | _script transfer_ | How `Execute Script In Target` and script keywords of \
+                [crl.remotescript.FP.html|RemoteScript.FP] pass the script over SSH. \
+                \"file\" copies the script to a temporary directory and executes it. \
+                \"stdin\" streams the script to the standard input of its interpreter, \
+                read from the #! line or sh by default, so that no files are created. \
+                The script must not read its standard input. The script is copied if \
+                _su password_ is set. | file |
+        | _ssh ciphers_ | Comma separated SSH ciphers offered before the other ciphers \
+                supported by paramiko in the given order, for example \
+                \"aes128-gcm@openssh.com\". The server chooses the first offered cipher it \
+                supports. Use `Benchmark Target Connection` to compare the settings. \
+                Requires paramiko 3.2 or newer as do the other _ssh_ properties except \
+                _ssh compression_. | None |
+        | _ssh compression_ | Enable zlib compression of the SSH connection. Helps with \
+                text heavy output and transfers on slow links but slows down fast \
+                links. | False |
+        | _ssh kex_ | Comma separated SSH key exchange algorithms offered first as \
+                in _ssh ciphers_. | None |
+        | _ssh macs_ | Comma separated SSH MAC algorithms offered first as in _ssh \
+                ciphers_. | None |
+        | _ssh max packet size_ | Maximum packet size in bytes of the SSH channels. None \
+                means the paramiko default. | None |
+        | _ssh window size_ | Flow control window size in bytes of the SSH channels. \
+                Larger window helps on high latency links. None means the paramiko \
+                default. | None |
         | _su password_     | Target su password | None |
         | _su username_     | Target su username. If defined, command and script  execution \
                 related keywords will do the execution under  this account. *NOTE:* \
@@ -163,6 +286,33 @@ class RemoteScript(object):
         """
         self._engine.default_properties[property_name] = property_value
 
+    def set_execution_pool_size(self, max_workers, max_queued=1000):
+        """
+        Sets the size of the thread pool running the executions.
+
+        Executions are run by a pool of reusable worker threads. At most
+        _max_workers_ executions, including background executions, run
+        at the same time and the rest wait for a free worker in the
+        order they were started. Starting a new execution blocks if
+        _max_queued_ executions are already waiting. Zero _max_queued_
+        does not limit the number of waiting executions. By default at
+        most 100 executions run at the same time and 1000 may wait.
+
+        Note that a long running background execution reserves a worker
+        until it has finished.
+
+        *Arguments:*\n
+        _max_workers_: Maximum number of executions running at the same time.\n
+        _max_queued_: Maximum number of executions waiting for a worker.\n
+
+        *Returns:*\n
+        Nothing.\n
+
+        *Example:*\n
+        | testcase | Set Execution Pool Size | 20 |
+        """
+        self._engine.set_execution_pool_size(max_workers, max_queued)
+
     def get_target_properties(self, target):
         """
         Returns python dict object containing effective properties for _target_.
@@ -229,6 +379,96 @@ class RemoteScript(object):
         """
         self._engine.execute_background(command, target, exec_id)
 
+    def execute_command_in_targets(self, command, targets, exec_id='foreground', timeout=None,
+                                   max_parallel=10):
+        """
+        Executes remote command in several targets concurrently.
+
+        At most _max_parallel_ executions are running at the same time. This
+        call will block until the command has been executed in all the
+        targets. Failure in one target does not abort the executions in the
+        other targets, but it is reported in the returned results.
+
+        *Arguments:*\n
+        _commmand_: Bash shell command to execute in the targets.\n
+        _targets_: List of target names or string of comma separated target names.\n
+        _exec_id_: Connection ID prefix to use. Connection ID of each execution is \
+                _exec_id_-_target_.\n
+        _timeout_: Timeout for the command in each target in seconds.\n
+        _max_parallel_: Maximum number of concurrent executions.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.MultiResult.html|MultiResult] object mapping target \
+        names to [crl.remotescript.result.Result.html|Result] objects.
+
+        *Example:*\n
+        | testcase | ${results}=     | Execute Command In Targets | uname -r | target_1, target_2 |
+        |          | Should Be Empty | ${results.failed}          |          |                    |
+        |          | Log             | ${results}                 |          |                    |
+        """
+        return self._engine.execute_in_targets(command, targets, exec_id, timeout, max_parallel)
+
+    def execute_streaming_command_in_target(self, command, callback, target='default',
+                                            exec_id='foreground', timeout=None, lines=False):
+        """
+        Executes remote command in the target and passes the output to _callback_ as it arrives.
+
+        The output is not stored, so the memory usage does not depend on the
+        amount of output. This call will block until the command has been
+        executed.
+
+        *Arguments:*\n
+        _commmand_: Bash shell command to execute in the target.\n
+        _callback_: Callable which is called with the stream name (\"stdout\" or
+        \"stderr\") and the output.\n
+        _target_: Name of the target where to execute the command.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout for command in seconds.\n
+        _lines_: If True, _callback_ is called once per output line, otherwise
+        with output chunks as received.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.Result.html|Result] object with exit status and
+        empty stdout and stderr.
+
+        *Example:*\n
+        | testcase | ${result}=      | Execute Streaming Command In Target | journalctl | ${log_line} | lines=True |
+        |          | Should Be Equal | ${result.status}                    | 0          |             |            |
+        """
+        return self._engine.execute_streaming(command, target, exec_id, timeout, callback, lines)
+
+    def iterate_command_output_in_target(self, command, target='default', exec_id='foreground',
+                                         timeout=None, lines=True):
+        """
+        Starts to execute remote command in the target and returns iterator over the output.
+
+        Iterating yields (stream, output) pairs where stream is \"stdout\" or
+        \"stderr\" as the output arrives. After the iteration has finished, the
+        [crl.remotescript.result.Result.html|Result] object of the command is
+        available in _result_ attribute of the iterator. Only a limited amount
+        of output is buffered, so the command waits while the iteration lags
+        behind. Calling _close_ of the iterator stops the command.
+
+        *Arguments:*\n
+        _commmand_: Bash shell command to execute in the target.\n
+        _target_: Name of the target where to execute the command.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout for command in seconds.\n
+        _lines_: If True, the output is yielded line by line, otherwise in chunks
+        as received.\n
+
+        *Returns:*\n
+        Iterator over the command output.
+
+        *Example:*\n
+        | testcase | ${output}=      | Iterate Command Output In Target | dmesg          |
+        |          | FOR             | ${stream}                        | ${line}        | IN | @{output} |
+        |          |                 | Log                              | ${line}        |    |           |
+        |          | END             |                                  |                |    |           |
+        |          | Should Be Equal | ${output.result.status}          | 0              |    |           |
+        """
+        return self._engine.iter_execute(command, target, exec_id, timeout, lines)
+
     def execute_script(self, file, target='default', exec_id='foreground', timeout=None):
         """*DEPRECATED* Keyword has been renamed to `Execute Script In Target`."""
         return self._engine.execute_script(file, target, exec_id, timeout, arguments=None)
@@ -238,7 +478,9 @@ class RemoteScript(object):
         Execute script file in remote target.
 
         Copies the file to the target and executes it. This call will
-        block until the command has been executed.
+        block until the command has been executed. With target property
+        _script cache_ the file is copied only once and with _script
+        transfer_ \"stdin\" it is not copied at all, see `Set Target Property`.
 
         *Arguments:*\n
         _file_: Path to file to execute (example: my_script.sh).\n
@@ -341,6 +583,11 @@ class RemoteScript(object):
         """
         Copy file from local host to the target.
 
+        With SFTP, files larger than target property _parallel transfer
+        threshold_ are written in parallel over several SFTP sessions, and a
+        partial copy left by an earlier failed copy is resumed if target
+        property _resume transfers_ is True, see `Set Target Property`.
+
         *Arguments:*\n
         _source_file_: Local source file.\n
         _destination_dir_: Remote destination directory. It is protocol specific
@@ -367,6 +614,13 @@ class RemoteScript(object):
         """
         Copy file from one remote target to another. Supports only SFTP.
 
+        The file is relayed through the local host or copied directly
+        between the targets depending on target property _copy mode_ of
+        the source target. When relaying, reading from the source target
+        runs ahead of the writes to the destination target by at most
+        target property _copy window_ of the source target bytes and the
+        writes are pipelined, see `Set Target Property`.
+
         *Arguments:*\n
         _from_target_: Source target.\n
         _source_file_: Source file.\n
@@ -377,7 +631,8 @@ class RemoteScript(object):
         _timeout_: Timeout in seconds.\n
 
         *Returns:*\n
-        [crl.remotescript.result.Result.html|Result] object.
+        [crl.remotescript.result.Result.html|Result] object whose stdout is \"direct\" or
+        \"relay\" depending on how the file was copied.
 
         *Example:*\n
         | testcase | Copy File Between Targets | default | /tmp/foo.tgz | target2 | /tmp/backups/ |
@@ -394,6 +649,11 @@ class RemoteScript(object):
         """
         Copy file from the target to local host.\n
 
+        With SFTP, files larger than target property _parallel transfer
+        threshold_ are read in parallel over several SFTP sessions, and a
+        partial copy left by an earlier failed copy is resumed if target
+        property _resume transfers_ is True, see `Set Target Property`.
+
         *Arguments:*\n
         _source_file_: Target source file.\n
         _destination_: Local destination directory or file.\n
@@ -421,6 +681,9 @@ class RemoteScript(object):
         """
         Copies contents of local source directory to remote destination directory.
 
+        The files are copied one by one or as a tar stream depending on
+        target property _directory transfer_, see `Set Target Property`.
+
         *Arguments:*\n
         _source_dir_: Local source directory whose contents are copied to the target.\n
         _target_dir_: Remote destination directory that will be created if missing.\n
@@ -437,6 +700,75 @@ class RemoteScript(object):
         """
         return self._engine.put_dir(source_dir, target_dir, mode, target, exec_id, timeout)
 
+    def sync_directory_to_target(self, source_dir, target_dir='.', mode=oct(0o755), compare='mtime',
+                                 delete=False, target='default', exec_id='foreground', timeout=None):
+        """
+        Copies new and changed files of local source directory to remote destination directory.
+
+        The remote directory is listed with one command and compared to
+        the local directory. With _compare_ \"size\" files of different
+        size are copied. With \"mtime\" also files whose modification time
+        differs from the remote file are copied. The copied files get the
+        modification time of the local file. With \"md5\" files whose MD5 checksum
+        differs are copied. The files are copied as in `Copy Directory To
+        Target`, one by one or as a tar stream depending on target property
+        _directory transfer_. Unchanged files keep their access mode.
+
+        *Arguments:*\n
+        _source_dir_: Local source directory whose contents are synchronized to the target.\n
+        _target_dir_: Remote destination directory that will be created if missing.\n
+        _mode_: Access mode to set to the files and directories copied to the target.\n
+        _compare_: How changed files are detected: \"size\", \"mtime\" or \"md5\".\n
+        _delete_: If True, remote files and directories missing from the source directory are removed.\n
+        _target_: Target where to copy the files.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout in seconds.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.SyncResult.html|SyncResult] object listing the sent, skipped and deleted files.\n
+
+        *Example:*\n
+        | testcase | ${result}= | Sync Directory To Target | tools | /opt/tools | compare=md5 | delete=True |
+        |          | Log        | ${result.sent}           |       |            |             |             |
+        """
+        return self._engine.sync_dir(source_dir, target_dir, mode, compare, delete, target, exec_id, timeout)
+
+    def copy_directory_from_target(self, source_dir, destination_dir='.', include=None, exclude=None,
+                                   target='default', exec_id='foreground', timeout=None):
+        """
+        Copies contents of remote source directory to local destination directory.
+
+        The directory is archived with tar in the target and the archive
+        is streamed over one command and extracted locally as it arrives,
+        so the memory usage does not depend on the size of the directory.
+        The archive is gzip compressed if target property _directory
+        transfer_ is \"tar.gz\", see `Set Target Property`. Requires SSH
+        and tar in the target.
+
+        The patterns are shell wildcards matched against the file and
+        directory names in the target. Files and directories matching
+        _exclude_ are skipped. If _include_ is given, only the files
+        matching it are copied. Archive members with absolute paths or
+        pointing outside _destination_dir_, for example symbolic links to
+        absolute paths, fail the copy.
+
+        *Arguments:*\n
+        _source_dir_: Remote source directory whose contents are copied.\n
+        _destination_dir_: Local destination directory that will be created if missing.\n
+        _include_: Comma or space separated list of file name patterns to copy.\n
+        _exclude_: Comma or space separated list of file and directory name patterns to skip.\n
+        _target_: Target where to copy the directory from.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout in seconds.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.Result.html|Result] object.\n
+
+        *Example:*\n
+        | testcase | Copy Directory From Target | /var/log | logs | include=*.log | exclude=old |
+        """
+        return self._engine.get_dir(source_dir, destination_dir, include, exclude, target, exec_id, timeout)
+
     def mkdir(self, path, mode=oct(0o755), target='default', exec_id='foreground', timeout=None):
         """*DEPRECATED* Keyword has been renamed to `Create Directory In Target`."""
         return self._engine.mkdir(path, mode, target, exec_id, timeout)
@@ -479,3 +811,38 @@ class RemoteScript(object):
         [crl.remotescript.result.Result.html|Result] object.\n
         """
         return self._engine.rmdir(path, target, exec_id, timeout)
+
+    def benchmark_target_connection(self, target='default', size=10485760, compressible=False, variants=None,
+                                    exec_id='foreground', timeout=None):
+        """
+        Measure the connection to the target with the current target
+        properties and with alternative property values.
+
+        Each run opens a new connection, executes an empty command five
+        times and copies a file of _size_ bytes to a temporary directory
+        of the target and back. The first run uses the current properties
+        of the target and each dictionary in _variants_ gives properties
+        changed for one additional run, for example _ssh compression_ or
+        _ssh ciphers_, see `Set Target Property`. Persistent and shared
+        connections are not used in the runs.
+
+        *Arguments:*\n
+        _target_: Target to measure.\n
+        _size_: Size of the copied file in bytes.\n
+        _compressible_: If True, the file contains repeated text lines,
+            otherwise random data.\n
+        _variants_: List of dictionaries of target properties to measure.\n
+        _exec_id_: Connection ID to use.\n
+        _timeout_: Timeout in seconds for each run.\n
+
+        *Returns:*\n
+        [crl.remotescript.result.BenchmarkResult.html|BenchmarkResult] object.
+
+        *Example:*\n
+        | testcase | &{compressed}= | Create Dictionary           | ssh compression=True |
+        |          | &{gcm}=        | Create Dictionary           | ssh ciphers=aes128-gcm@openssh.com |
+        |          | @{variants}=   | Create List                 | ${compressed}        | ${gcm} |
+        |          | ${result}=     | Benchmark Target Connection | variants=${variants} | compressible=True |
+        |          | Log            | ${result.stdout}            |                      |        |
+        """
+        return self._engine.benchmark(target, size, compressible, variants, exec_id, timeout)
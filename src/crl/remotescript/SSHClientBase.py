@@ -7,11 +7,14 @@ __copyright__ = 'Copyright(C) 2019, Nokia'
 class SSHClientBase(object):
 
     BUFFER_SIZE = 32768
+    STDIN_SUPPORTED = False
 
     def __init__(self):
         self.client = None
         self.su_username = None
         self.su_password = None
+        self._home_dir = None
+        self._known_dirs = set()  # remote directories known to exist
 
     def set_su_user(self, username, password=None):
         self.su_username = username
@@ -20,6 +23,27 @@ class SSHClientBase(object):
     def get_su_username(self):
         return self.su_username
 
+    @staticmethod
+    def is_alive():
+        return False
+
+    def set_transport_options(self, **options):
+        """
+        Sets SSH transport options. Ignored by clients not supporting them.
+        """
+
+    def close_channels(self, owner):
+        self.close_connection()
+
+    def close_connection(self):
+        raise NotImplementedError()
+
+    def forget_dirs(self):
+        """
+        Clears the cache of known remote directories.
+        """
+        self._known_dirs = set()
+
     @property
     def su_command_template(self):
         raise NotImplementedError()
@@ -33,9 +57,10 @@ class SSHClientBase(object):
             return self.su_command_template.format(su_username=self.su_username, command=command)
         return command
 
-    @staticmethod
-    def _resolve_dir(sftp, dst_dir):
-        dst_home = sftp.normalize('.')
+    def _resolve_dir(self, sftp, dst_dir):
+        if self._home_dir is None:
+            self._home_dir = sftp.normalize('.')
+        dst_home = self._home_dir
         dst_dir = dst_dir.split(':')[-1].replace('\\', '/')
         if dst_dir == '.':
             dst_dir = dst_home + '/'
@@ -5,9 +5,10 @@ from .baseengine import (
     ExecutionError, TimeoutError)
 from .RemoteScript import RemoteScript
 from .FP import FP
+from .asyncremotescript import AsyncRemoteScript
 
 
 __copyright__ = 'Copyright (C) 2019, Nokia'
 
 __all__ = ['NoExitStatusError', 'NonZeroExitStatusError', 'ExecutionError', 'TimeoutError',
-           'RemoteScript', 'FP']
+           'RemoteScript', 'FP', 'AsyncRemoteScript']
@@ -1,6 +1,6 @@
 __copyright__ = 'Copyright (C) 2019, Nokia'
 
-VERSION = '1.0.3'
+VERSION = '1.1.0'
 GITHASH = ''
 
 
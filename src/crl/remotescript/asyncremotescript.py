@@ -0,0 +1,205 @@
+# pylint: disable=redefined-builtin,protected-access
+import itertools
+from crl.remotescript.baseengine import ExecutionError, TimeoutError
+from crl.remotescript.FP import FP
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+class AsyncRemoteScript(object):
+    """
+    asyncio interface to RemoteScript operations.
+
+    Targets and their properties are handled as in
+    [crl.remotescript.RemoteScript.html|RemoteScript] and the
+    operations take the same arguments as the corresponding keywords
+    without _exec_id_. Each operation starts the execution in the engine
+    worker pool and returns immediately an asyncio future resolved with
+    the [crl.remotescript.result.Result.html|Result] of the execution
+    in the event loop of the caller. The futures can be awaited and
+    gathered like coroutines. The number of concurrently running
+    operations is limited by `set_execution_pool_size`. If the execution
+    queue is full, the future fails with _ExecutionError_ instead of
+    blocking the event loop.
+
+    If _timeout_ expires, the execution is interrupted and the future
+    fails with _TimeoutError_. Cancelling the future interrupts the
+    execution.
+
+    The operations must be called from a coroutine or callback running
+    in the event loop. Requires Python 3.
+
+    *Example:*\n
+    | async def uptimes(hosts):
+    |     remotescript = AsyncRemoteScript()
+    |     for host in hosts:
+    |         remotescript.set_target(host, 'root', 'root', name=host)
+    |     try:
+    |         return await asyncio.gather(
+    |             *[remotescript.execute('uptime', target=host) for host in hosts])
+    |     finally:
+    |         remotescript.close()
+    """
+
+    def __init__(self):
+        if asyncio is None:
+            raise ImportError('AsyncRemoteScript requires asyncio')
+        self._library = FP()
+        self._engine = self._library._engine
+        self._exec_ids = itertools.count(1)
+        self._timed_out = set()
+
+    def close(self):
+        """
+        Closes persistent connections and stops idle workers.
+        """
+        self._library._close()
+
+    def set_target(self, host, username, password, name='default', protocol='ssh/sftp'):
+        self._library.set_target(host, username, password, name, protocol)
+
+    def set_target_with_sshkeyfile(self, host, username, sshkeyfile, name='default', protocol='ssh/sftp'):
+        self._library.set_target_with_sshkeyfile(host, username, sshkeyfile, name, protocol)
+
+    def set_target_property(self, target_name, property_name, property_value):
+        self._library.set_target_property(target_name, property_name, property_value)
+
+    def set_default_target_property(self, property_name, property_value):
+        self._library.set_default_target_property(property_name, property_value)
+
+    def get_target_properties(self, target):
+        return self._library.get_target_properties(target)
+
+    def set_execution_pool_size(self, max_workers, max_queued=1000):
+        self._library.set_execution_pool_size(max_workers, max_queued)
+
+    def execute(self, command, target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._execute_impl,
+                           [command, target, exec_id, True], timeout)
+
+    def execute_script(self, file, target='default', timeout=None, arguments=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._execute_script_impl,
+                           [file, target, exec_id, arguments], timeout)
+
+    def put_file(self, source_file, destination_dir='.', mode=oct(0o755), target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._put_file_impl,
+                           [source_file, destination_dir, mode, target, exec_id], timeout)
+
+    def get_file(self, source_file, destination='.', target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._get_file_impl,
+                           [source_file, destination, target, exec_id], timeout)
+
+    def copy_file(self, from_target, source_file, to_target, destination_dir='.', mode=oct(0o755),
+                  timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, [from_target, to_target], self._engine._copy_file_impl,
+                           [from_target, source_file, to_target, destination_dir, mode, exec_id], timeout)
+
+    def put_dir(self, source_dir, target_dir='.', mode=oct(0o755), target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._put_dir_impl,
+                           [source_dir, target_dir, mode, target, exec_id], timeout)
+
+    def sync_dir(self, source_dir, target_dir='.', mode=oct(0o755), compare='mtime', delete=False,
+                 target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._sync_dir_impl,
+                           [source_dir, target_dir, mode, compare, delete, target, exec_id], timeout)
+
+    def get_dir(self, source_dir, destination_dir='.', include=None, exclude=None, target='default',
+                timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._get_dir_impl,
+                           [source_dir, destination_dir, include, exclude, target, exec_id], timeout)
+
+    def mkdir(self, path, mode=oct(0o755), target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._mkdir_impl,
+                           [path, mode, target, exec_id], timeout)
+
+    def rmdir(self, path, target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._rmdir_impl,
+                           [path, target, exec_id], timeout)
+
+    def node_execute(self, node, command, target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._node_execute_impl,
+                           [node, command, target, exec_id], timeout)
+
+    def node_execute_script(self, node, file, target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._node_script_impl,
+                           [node, file, target, exec_id], timeout)
+
+    def node_put_file(self, node, source_file, destination_dir='.', mode=oct(0o755), target='default',
+                      timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._node_put_file_impl,
+                           [node, source_file, destination_dir, mode, target, exec_id], timeout)
+
+    def node_get_file(self, node, source_file, destination='.', target='default', timeout=None):
+        exec_id = self._new_exec_id()
+        return self._start(exec_id, target, self._engine._node_get_file_impl,
+                           [node, source_file, destination, target, exec_id], timeout)
+
+    def _new_exec_id(self):
+        return 'async-%d' % next(self._exec_ids)
+
+    def _start(self, exec_id, targets, command, args, timeout):
+        loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+        future = loop.create_future()
+        # The timer is set before the execution which may finish at once
+        timer = loop.call_later(float(timeout), self._expire, exec_id) if timeout else None
+        try:
+            # Full execution queue fails the future instead of blocking the event loop
+            self._engine._start_thread(
+                exec_id, targets, command, args,
+                lambda runner: loop.call_soon_threadsafe(self._finish, future, exec_id, timer),
+                block=False)
+        except ExecutionError as e:
+            if timer is not None:
+                timer.cancel()
+            future.set_exception(e)
+            return future
+        future.add_done_callback(lambda f: self._interrupt(exec_id) if f.cancelled() else None)
+        return future
+
+    def _expire(self, exec_id):
+        self._timed_out.add(exec_id)
+        self._interrupt(exec_id)
+
+    def _interrupt(self, exec_id):
+        runner = self._engine._threads.get(exec_id)
+        if runner is not None and runner.is_alive():
+            runner.interrupt()
+
+    def _finish(self, future, exec_id, timer):
+        if timer is not None:
+            timer.cancel()
+        timed_out = exec_id in self._timed_out
+        self._timed_out.discard(exec_id)
+        result = error = None
+        try:
+            result = self._engine._join_thread(exec_id)
+        except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+            error = e
+        self._engine._threads.pop(exec_id, None)
+        if future.done():
+            return
+        if timed_out:
+            future.set_exception(TimeoutError('Execution ID "' + exec_id + '" timed out'))
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
@@ -1,17 +1,43 @@
 # pylint: disable=unused-argument,protected-access
 # pylint: disable=redefined-builtin
+import contextlib
+import copy
+import hashlib
 import os
+import posixpath
 import random
+import re
+import shutil
 import sys
+import tempfile
 import threading
 import time
 import traceback
 from logging import debug, error
 from crl.remotescript import pathops
 from crl.remotescript import connectionmediator
-from crl.remotescript.result import Result
+from crl.remotescript import tarstream
+from crl.remotescript.chunkedtransfer import ChunkedTransfer
+from crl.remotescript.compatibility import shell_quote, to_bytes, to_string
+from crl.remotescript.connectionpool import ConnectionPool
+from crl.remotescript.output import (
+    BoundedOutputCollector,
+    OutputCollector,
+    OutputStream,
+    SpilledOutput,
+    SpillingOutputCollector,
+    StreamingOutput,
+    STDOUT,
+    STDERR)
+from crl.remotescript.result import BenchmarkResult, Result, MultiResult, SyncResult
+from crl.remotescript.workerpool import WorkerPool
 from robot.libraries.BuiltIn import BuiltIn
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
 
 __copyright__ = 'Copyright (C) 2019, Nokia'
 
@@ -28,6 +54,10 @@ class ExecutionError(Exception):
     pass
 
 
+class _DirectCopyCleanupError(ExecutionError):
+    pass
+
+
 class TimeoutError(ExecutionError):
     pass
 
@@ -36,9 +66,14 @@ class SSHException(Exception):
     pass
 
 
-class _ExecutionRunner(threading.Thread):
-    def __init__(self, targets, command, args, lib):
-        threading.Thread.__init__(self)
+class _ExecutionRunner(object):
+    """
+    Execution of _command_ in _targets_ run by a worker of the engine
+    worker pool.
+    """
+
+    def __init__(self, name, targets, command, args, lib, callback=None):
+        self.name = name
         if isinstance(targets, list):
             self.targets = targets
         else:
@@ -52,13 +87,46 @@ class _ExecutionRunner(threading.Thread):
         self.trace = None
         self.connections = list()
         self.interrupted = False
+        self.finished = False
+        self.thread = None
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self, block=True):
+        self.lib._worker_pool.submit(self, block)
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def is_alive(self):
+        return not self._done.is_set()
 
     def run(self):
+        with self._lock:
+            if self.interrupted:
+                return
+            self.thread = threading.current_thread()
+        self.lib._thread_local.runner = self
+        try:
+            self._run()
+        finally:
+            self.lib._thread_local.runner = None
+            self._finish()
+
+    def _finish(self):
+        self.lib._notify_finished(self)
+        self._done.set()
+        if self.callback is not None:
+            self.callback(self)
+
+    def _run(self):
         try:
             self.lib._thread_local.connection = None
             self.lib._thread_local.connections = list()
             self.lib._thread_local.transaction_level = 0
             self.lib._thread_local.messages = list()
+            self.lib._thread_local.reconnect = None
             if self.lib._start_transaction(self.targets):
                 try:
                     if not self.interrupted:
@@ -76,9 +144,20 @@ class _ExecutionRunner(threading.Thread):
             self.messages = self.lib._thread_local.messages
 
     def interrupt(self):
-        self.interrupted = True
+        with self._lock:
+            self.interrupted = True
+            queued = self.thread is None
+        if queued:
+            # Still waiting for a worker, never started
+            self.result = Result.CONNECTION_FAILURE
+            self.messages = list()
+            self._finish()
+            return
         for con in self.connections:
-            con.close_connection()
+            if self.lib._connection_pool.owns(con):
+                con.close_channels(self.thread)
+            else:
+                con.close_connection()
         self.connections = list()
 
 
@@ -86,26 +165,61 @@ class BaseEngine(object):
     CONNECTION_MONITOR_CMD = '( while :; do if ! kill -0 $PPID &>/dev/null; \
             then /bin/kill -s HUP -$$; break; fi; if ! kill -0 $$ &>/dev/null; \
             then break; fi; usleep 100 &>/dev/null || sleep 1; done & )'
+    _INTERRUPT_TIMEOUT = 5
+    MAX_WORKERS = 100
+    MAX_QUEUED = 1000
 
     def __init__(self):
         self._temp_id = str(random.randint(100000000, 999999999))
         self.targets = dict()  # <name, Target>
         self._threads = dict()  # <connection alias, thread>
-        self._main_thread = threading.currentThread()
+        self._main_thread = threading.current_thread()
+        self._finished = threading.Condition()
         # contains SSH or Telnet connectionmediator instance and transaction_level
         self._thread_local = threading.local()
+        self._connection_pool = ConnectionPool()
+        self._shared_channels = dict()  # <target name, [channel count]>
+        self._shared_channels_lock = threading.Lock()
+        self._worker_pool = WorkerPool(self.MAX_WORKERS, self.MAX_QUEUED)
+        self._local_tempdir = None
+        self._local_tempdir_lock = threading.Lock()
+        self._script_cache_targets = set()
+        self._script_cache_lock = threading.Lock()
         self.default_properties = {
             'cleanup': True,
             'connection break is error': True,
             'connection failure is error': True,
+            'connection idle timeout': 300,
+            'copy mode': 'relay',
+            'copy window': 4 * 1024 * 1024,
+            'directory transfer': 'file',
             'login prompt': 'login: ',
             'login timeout': 60,
+            'max channels per connection': 1,
             'max connection attempts': 10,
+            'max output size': None,
             'nonzero status is error': False,
+            'output overflow': 'truncate',
+            'parallel transfer channels': 4,
+            'parallel transfer chunk size': 8 * 1024 * 1024,
+            'parallel transfer threshold': 100 * 1024 * 1024,
             'password prompt': 'Password: ',
+            'persistent connection': False,
             'port': None,
             'prompt is regexp': False,
             'prompt': '$ ',
+            'resume transfers': False,
+            'script cache': False,
+            'script cache dir': '/tmp/pdrobot-remotescript-cache',
+            'script cache max age': 7 * 24 * 3600,
+            'script cache max size': 100 * 1024 * 1024,
+            'script transfer': 'file',
+            'ssh ciphers': None,
+            'ssh compression': False,
+            'ssh kex': None,
+            'ssh macs': None,
+            'ssh max packet size': None,
+            'ssh window size': None,
             'tempdir': '/tmp/pdrobot-remotescript/' + self._temp_id,
             'su username': None,
             'su password': None,
@@ -123,6 +237,22 @@ class BaseEngine(object):
         properties.update(self.targets[target].properties)
         return properties
 
+    def close(self):
+        """
+        Evicts old scripts from the script caches, closes all the
+        persistent connections, stops idle workers and removes local
+        temporary files.
+        """
+        self._evict_script_caches()
+        self._connection_pool.close()
+        self._worker_pool.shutdown()
+        if self._local_tempdir is not None:
+            shutil.rmtree(self._local_tempdir, ignore_errors=True)
+            self._local_tempdir = None
+
+    def set_execution_pool_size(self, max_workers, max_queued):
+        self._worker_pool.resize(int(max_workers), int(max_queued))
+
     def _check_target(self, target):
         if target not in self.targets:
             raise ValueError('Unknown target: "' + target +
@@ -174,44 +304,203 @@ class BaseEngine(object):
     def execute_background(self, command, target, exec_id):
         self._start_thread(exec_id, target, self._execute_impl, [command, target, exec_id, True])
 
+    def execute_streaming(self, command, target, exec_id, timeout, callback, lines=False):
+        return self._execute_with_output(command, target, exec_id, timeout,
+                                         StreamingOutput(callback, lines))
+
+    def iter_execute(self, command, target, exec_id, timeout, lines=False):
+        return OutputStream(
+            lambda output: self._execute_with_output(command, target, exec_id, timeout, output),
+            lines, interrupt=lambda: self._interrupt_thread(exec_id))
+
+    def _execute_with_output(self, command, target, exec_id, timeout, output):
+        self._start_thread(exec_id, target, self._execute_impl,
+                           [command, target, exec_id, True, output])
+        return self._join_thread(exec_id, timeout)
+
+    def execute_in_targets(self, command, targets, exec_id, timeout, max_parallel):
+        targets = self._split_list(targets)
+        self._check_targets(targets)
+        return self._run_in_parallel(
+            targets, exec_id, timeout, max_parallel,
+            lambda target, target_exec_id: self._start_thread(
+                target_exec_id, target, self._execute_impl, [command, target, target_exec_id, True]))
+
+    @staticmethod
+    def _split_list(values):
+        """
+        Returns _values_ given as list or as comma or whitespace separated string as list.
+        """
+        if not values:
+            return []
+        if isinstance(values, (list, tuple)):
+            return list(values)
+        return [v for v in re.split(r'[,\s]+', values) if v]
+
+    def _run_in_parallel(self, names, exec_id, timeout, max_parallel, start):
+        """
+        Runs operation for each name in _names_ with at most _max_parallel_
+        operations running at the same time. _start_ is called with the name
+        and an execution ID derived from _exec_id_ and it must start the
+        execution with `_start_thread`. _timeout_ is applied to each
+        execution separately. Returns `MultiResult` mapping the names to
+        the results.
+        """
+        results = MultiResult()
+        started = time.time()
+        timeout = float(timeout) if timeout else None
+        max_parallel = max(1, int(max_parallel))
+        waiting = list(names)
+        running = dict()  # <name, (exec_id, start time)>
+        interrupted = dict()  # <name, interrupt time>
+        while waiting or running:
+            # Interrupted executions do not hold back the waiting ones
+            while waiting and len(running) - len(interrupted) < max_parallel:
+                name = waiting.pop(0)
+                name_exec_id = '%s-%s' % (exec_id, name)
+                try:
+                    start(name, name_exec_id)
+                    running[name] = (name_exec_id, time.time())
+                except ExecutionError as e:
+                    self._set_failed_result(results, name, e, 0.0)
+            for name in self._wait_for_finished(running, interrupted, timeout):
+                name_exec_id, name_started = running.pop(name)
+                elapsed = time.time() - name_started
+                if name not in interrupted:
+                    try:
+                        results[name] = self._join_thread(name_exec_id)
+                        results.timings[name] = elapsed
+                    except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                        self._set_failed_result(results, name, e, elapsed)
+                    continue
+                del interrupted[name]
+                message = 'Execution ID "' + name_exec_id + '" timed out'
+                if self._threads[name_exec_id].finished:
+                    try:
+                        self._join_thread(name_exec_id)
+                    except Exception:  # pylint: disable=broad-except; noqa: W0703
+                        pass
+                else:
+                    self._threads[name_exec_id] = None
+                    message += ': failed to interrupt running thread'
+                self._set_failed_result(results, name, TimeoutError(message), elapsed)
+        results.elapsed = time.time() - started
+        return results
+
+    def _wait_for_finished(self, running, interrupted, timeout):
+        """
+        Waits until some of the _running_ executions have finished and
+        returns their names. Executions running longer than _timeout_
+        are interrupted and added to _interrupted_ without waiting for
+        them to stop, and an empty list is returned so that the caller can
+        start the waiting executions. The names of the interrupted
+        executions are returned when they have stopped or if they have
+        not stopped in `_INTERRUPT_TIMEOUT` seconds.
+        """
+        with self._finished:
+            while True:
+                now = time.time()
+                done = [name for name, (name_exec_id, _) in running.items()
+                        if self._threads[name_exec_id].finished or
+                        now - interrupted.get(name, now) >= BaseEngine._INTERRUPT_TIMEOUT]
+                if done or not running:
+                    return done
+                expired = list()
+                if timeout is not None:
+                    expired = [name for name, (_, name_started) in running.items()
+                               if name not in interrupted and now - name_started >= timeout]
+                if expired:
+                    break
+                deadlines = [t + BaseEngine._INTERRUPT_TIMEOUT for t in interrupted.values()]
+                if timeout is not None:
+                    deadlines.extend(name_started + timeout for name, (_, name_started) in running.items()
+                                     if name not in interrupted)
+                self._finished.wait(min(deadlines) - now if deadlines else None)
+        for name in expired:
+            interrupted[name] = time.time()
+            self._threads[running[name][0]].interrupt()
+        return []
+
+    def _notify_finished(self, runner):
+        with self._finished:
+            runner.finished = True
+            self._finished.notify_all()
+
+    @staticmethod
+    def _set_failed_result(results, name, exception, elapsed):
+        results[name] = Result(Result.UNKNOWN_STATUS, '', '', Result.OPEN_OK, Result.CLOSE_FAIL)
+        results.errors[name] = '%s: %s' % (type(exception).__name__, exception)
+        results.timings[name] = elapsed
+
     def wait_background(self, exec_id, timeout):
         return self._join_thread(exec_id, timeout)
 
+    def _interrupt_thread(self, exec_id):
+        runner = self._threads.get(exec_id)
+        if runner is not None and runner.is_alive():
+            runner.interrupt()
+
     def kill_background(self, exec_id):
         if self._threads[exec_id].is_alive():
             self._threads[exec_id].interrupt()
 
-    def _execute_impl(self, command, target, exec_id, check_su=False):
+    def _execute_impl(self, command, target, exec_id, check_su=False, output=None, stdin=None):
         status = Result.UNKNOWN_STATUS
         out = ""
         err = ""
-        end = Result.CLOSE_FAIL
+        output = self._create_output(target) if output is None else output
         try:
             if check_su:
                 command = self._thread_local.connection.get_su_command(command)
             self._debug('Executing command "' + command + '"')
-            (status, out, err) = self._thread_local.connection.execute_command(
-                BaseEngine.CONNECTION_MONITOR_CMD + '; ' + command)  # Here's the beef
-            out = out.strip()
-            err = err.strip()
+            args = [BaseEngine.CONNECTION_MONITOR_CMD + '; ' + command, output]
+            if stdin is not None:
+                args.append(stdin)
+            (status, out, err) = self._thread_local.connection.execute_command(*args)  # Here's the beef
+            out = self._strip_output(out)
+            err = self._strip_output(err)
         except SSHException:
             self._debug("Connecttion closed unexpectedly")
             if self._get_bool_target_property(target, 'connection break is error'):
                 raise
+        end = Result.CLOSE_FAIL if status == Result.UNKNOWN_STATUS else Result.CLOSE_OK
+        result = Result(status, out, err, Result.OPEN_OK, end,
+                        output.truncated[STDOUT], output.truncated[STDERR])
         if status == Result.UNKNOWN_STATUS:
             if self._get_bool_target_property(target, 'connection break is error'):
                 msg = 'Command execution failure, did not get exit status'
-                msg += ', stdout="' + pathops.unic(out) + '"'
-                msg += ', stderr="' + pathops.unic(err) + '"'
+                msg += ', stdout="' + pathops.unic(result.stdout) + '"'
+                msg += ', stderr="' + pathops.unic(result.stderr) + '"'
                 raise NoExitStatusError(msg)
-        else:
-            end = Result.CLOSE_OK
         if self._get_bool_target_property(target, 'nonzero status is error') and status != '0':
             msg = 'status="' + status + '"'
-            msg += ', stdout="' + pathops.unic(out) + '"'
-            msg += ', stderr="' + pathops.unic(err) + '"'
+            msg += ', stdout="' + pathops.unic(result.stdout) + '"'
+            msg += ', stderr="' + pathops.unic(result.stderr) + '"'
             raise NonZeroExitStatusError(msg)
-        return Result(status, out, err, Result.OPEN_OK, end)
+        return result
+
+    def _create_output(self, target):
+        props = self.get_target_properties(target)
+        max_size = props.get('max output size')
+        if not max_size:
+            return OutputCollector()
+        max_size = int(BuiltIn().convert_to_integer(max_size))
+        overflow = str(props.get('output overflow')).lower()
+        if overflow == 'file':
+            return SpillingOutputCollector(max_size, self._get_local_tempdir())
+        if overflow != 'truncate':
+            raise ValueError('Unsupported output overflow "' + overflow + '"')
+        return BoundedOutputCollector(max_size)
+
+    @staticmethod
+    def _strip_output(output):
+        return output if isinstance(output, SpilledOutput) else output.strip()
+
+    def _get_local_tempdir(self):
+        with self._local_tempdir_lock:
+            if self._local_tempdir is None:
+                self._local_tempdir = tempfile.mkdtemp(prefix='remotescript-' + self._temp_id + '-')
+        return self._local_tempdir
 
     def execute_script(self, file, target, exec_id, timeout, arguments):
         self._start_thread(exec_id, target, self._execute_script_impl,
@@ -227,6 +516,10 @@ class BaseEngine(object):
             arguments = []
         if not os.path.exists(script_file):
             raise IOError('File not found ' + script_file + ' (Working  directory: ' + os.getcwd() + ')')
+        if self._use_script_stdin(target, check_su=True):
+            return self._execute_streamed_script_impl(script_file, target, exec_id, arguments)
+        if self._get_bool_target_property(target, 'script cache'):
+            return self._execute_cached_script_impl(script_file, target, exec_id, arguments)
         filename = os.path.basename(script_file)
         target_temp_dir = pathops.append(self._get_str_target_property(target, 'tempdir'), '-' + exec_id)
         target_temp_dir = pathops.directorize(target_temp_dir)
@@ -246,6 +539,118 @@ class BaseEngine(object):
                 self._debug('Target "' + str(target) + '" cleanup failed. ' + str(sys.exc_info()[1]))
         return result
 
+    def _use_script_stdin(self, target, check_su=False):
+        transfer = self._get_str_target_property(target, 'script transfer').lower()
+        if transfer not in ['file', 'stdin']:
+            raise ValueError('Unsupported script transfer "' + transfer + '"')
+        if transfer == 'file':
+            return False
+        connection = self._thread_local.connection
+        if not connection.supports_stdin():
+            self._debug('Streaming script is not supported for target "' + target + '", copying the script')
+            return False
+        if check_su and connection.get_su_username() and self._get_target_property(target, 'su password', ''):
+            self._debug('su password requires terminal, copying the script to target "' + target + '"')
+            return False
+        return True
+
+    def _execute_streamed_script_impl(self, script_file, target, exec_id, arguments):
+        """
+        Executes _script_file_ by streaming it to the standard input of
+        its interpreter in the target without creating any files.
+        """
+        command = self._get_stdin_interpreter(script_file) + ''.join(' ' + a for a in arguments)
+        self._debug('Streaming ' + script_file + ' to target ' + target)
+        return self._execute_impl(self._thread_local.connection.get_su_command(command), target, exec_id,
+                                  stdin=lambda f: self._copy_file_to(script_file, f))
+
+    _STDIN_SHELLS = ['sh', 'bash', 'dash', 'ksh', 'zsh', 'ash']
+
+    @staticmethod
+    def _get_stdin_interpreter(script_file):
+        """
+        Returns command reading script from standard input with the
+        interpreter given in the #! line of _script_file_ or with sh.
+        Options ending with "--" are added for shells and "-" for other
+        interpreters like python and perl.
+        """
+        with open(script_file, 'rb') as f:
+            first_line = f.readline()
+        interpreter = to_string(first_line[2:]).strip() if first_line.startswith(b'#!') else ''
+        words = interpreter.split() or ['sh']
+        program = os.path.basename(words[1] if os.path.basename(words[0]) == 'env' and len(words) > 1
+                                   else words[0])
+        return ' '.join(words) + (' -s --' if program in BaseEngine._STDIN_SHELLS else ' -')
+
+    @staticmethod
+    def _copy_file_to(path, fileobj):
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, fileobj, 65536)
+
+    def _execute_cached_script_impl(self, script_file, target, exec_id, arguments):
+        """
+        Executes _script_file_ stored in the target script cache under the
+        checksum of its content. The script is copied to the cache only
+        if it is not there yet.
+
+        The cache is used only if its directory is owned by the user and
+        not writable by others, and a cached script only if it is owned
+        by the user and its checksum matches, so that other users cannot
+        plant scripts to be executed.
+        """
+        cache_dir = self._get_str_target_property(target, 'script cache dir')
+        digest = self._get_file_digest(script_file, 'sha1')
+        script_dir = pathops.join(cache_dir, digest)
+        script_path = pathops.join(script_dir, os.path.basename(script_file))
+        with self._script_cache_lock:
+            self._script_cache_targets.add(target)
+        private = 'test -O {0} && test -z "$(find {0} -maxdepth 0 -perm /022)"'.format(shell_quote(cache_dir))
+        result = self._execute_impl(
+            '%s && test -O %s && test "$(sha1sum < %s | cut -c1-40)" = %s && touch %s && echo cached || true' % (
+                private, shell_quote(script_path), shell_quote(script_path), digest, shell_quote(script_dir)),
+            target, exec_id)
+        if result.stdout != 'cached':
+            self._debug('Caching ' + script_file + ' to ' + target + ':' + script_dir)
+            # Directories are searchable by su users executing the scripts
+            result = self._execute_impl(
+                'umask 066 && mkdir -p -m 711 %s && %s && mkdir -p -m 711 %s' % (
+                    shell_quote(cache_dir), private, shell_quote(script_dir)),
+                target, exec_id)
+            if result.status != '0':
+                raise ExecutionError('Script cache dir "%s:%s" is not private to the user: %s' % (
+                    target, cache_dir, result))
+            self._put_file_impl(script_file, pathops.directorize(script_dir), oct(0o755), target, exec_id)
+        command = self._thread_local.connection.get_su_command(script_path) + " " + " ".join(arguments)
+        return self._execute_impl("cd " + script_dir + "; " + command, target, exec_id)
+
+    def _evict_script_caches(self):
+        with self._script_cache_lock:
+            targets = sorted(self._script_cache_targets)
+            self._script_cache_targets = set()
+        for target in targets:
+            exec_id = 'script-cache-eviction-' + target
+            try:
+                self._start_thread(exec_id, target, self._evict_script_cache_impl, [target, exec_id])
+                self._join_thread(exec_id, 60)
+            except Exception:  # pylint: disable=broad-except; noqa: W0703
+                debug('Evicting script cache of target "%s" failed: %s' % (target, sys.exc_info()[1]))
+
+    def _evict_script_cache_impl(self, target, exec_id):
+        """
+        Removes the cached scripts not used within _script cache max age_
+        and then the least recently used scripts exceeding _script cache
+        max size_.
+        """
+        max_age = int(self._get_int_target_property(target, 'script cache max age'))
+        max_size = int(self._get_int_target_property(target, 'script cache max size'))
+        return self._execute_impl(
+            'cd %s || exit 0; '
+            'find . -mindepth 1 -maxdepth 1 -type d -mmin +%d -exec rm -rf {} +; '
+            'total=0; for d in $(ls -1t); do total=$((total + $(du -sk "$d" | cut -f1))); '
+            'if [ $total -gt %d ]; then rm -rf "$d"; fi; done' % (
+                self._get_str_target_property(target, 'script cache dir'), max_age // 60, max_size // 1024),
+            target, exec_id)
+
     def copy_file(self, from_target, source_file, to_target, destination_dir, mode, exec_id, timeout):
         self._start_thread(exec_id, [from_target, to_target], self._copy_file_impl,
                            [from_target, source_file, to_target, destination_dir, mode, exec_id])
@@ -253,12 +658,89 @@ class BaseEngine(object):
 
     def _copy_file_impl(self, from_target, source_file, to_target, destination_dir, mode, exec_id):
         destination_dir = pathops.directorize(destination_dir)
+        copy_mode = self._get_str_target_property(from_target, 'copy mode').lower()
+        if copy_mode not in ['relay', 'direct']:
+            raise ValueError('Unsupported copy mode "' + copy_mode + '"')
+        if copy_mode == 'direct':
+            try:
+                self._copy_file_direct(from_target, source_file, to_target, destination_dir, mode, exec_id)
+                return Result('0', 'direct', '', Result.OPEN_OK, Result.CLOSE_OK)
+            except _DirectCopyCleanupError:
+                raise
+            except Exception:  # pylint: disable=broad-except; noqa: W0703
+                self._debug('Direct copy from "%s" to "%s" failed, relaying through local host: %s' % (
+                    from_target, to_target, sys.exc_info()[1]))
         self._debug(''.join(
             ['Copying file from target "', from_target, ':', source_file,
              '" to "', to_target, ':', destination_dir, '"']))
-        self._thread_local.connections[0].copy_file(self._thread_local.connections[1],
-                                                    source_file, destination_dir, mode)
-        return Result.SUCCESS
+        self._thread_local.connections[0].copy_file(
+            self._thread_local.connections[1], source_file, destination_dir, mode,
+            int(self._get_int_target_property(from_target, 'copy window')))
+        return Result('0', 'relay', '', Result.OPEN_OK, Result.CLOSE_OK)
+
+    # Options restricting the temporary key to receiving the copied file
+    _DIRECT_COPY_KEY_OPTIONS = 'restrict'
+
+    def _copy_file_direct(self, from_target, source_file, to_target, destination_dir, mode, exec_id):
+        """
+        Copies _source_file_ with scp run in _from_target_ using temporary
+        key authorized in _to_target_ for the duration of the copy. The
+        key is only allowed to run scp receiving the destination file.
+        """
+        source, destination = self._thread_local.connections
+        if not source.supports_stdin():
+            raise ExecutionError('Direct copy requires SSH')
+        to = self.targets[to_target]
+        host = '[' + to.host + ']' if ':' in to.host else to.host
+        destination_file = pathops.join(destination_dir, os.path.basename(source_file))
+        comment = 'remotescript-copy-' + self._temp_id + '-' + re.sub(r'\W', '_', exec_id)
+        private_key, public_key = source.generate_key(comment)
+        forced_command = 'scp -t -- ' + shell_quote(destination_file)
+        key_line = '%s,command="%s" %s' % (
+            self._DIRECT_COPY_KEY_OPTIONS, forced_command.replace('"', '\\"'), public_key)
+        self._debug(''.join(
+            ['Copying file directly from target "', from_target, ':', source_file,
+             '" to "', to_target, ':', destination_dir, '"']))
+        self._execute_checked(
+            destination, 'mkdir -p %s && umask 077 && mkdir -p ~/.ssh && echo %s >> ~/.ssh/authorized_keys' % (
+                shell_quote(destination_dir), shell_quote(key_line)), to_target, exec_id)
+        copied = False
+        try:
+            # OpenSSH 9 scp uses SFTP unless -O selects the scp protocol of the forced command
+            self._execute_checked(
+                source, "o=-O; scp -O 2>&1 | grep -qi 'illegal option\\|unknown option' && o=; "
+                'k=$(mktemp) && cat > $k && scp $o -q -B -i $k -oStrictHostKeyChecking=no '
+                '-oUserKnownHostsFile=/dev/null -oConnectTimeout=10 -P %s %s %s; s=$?; rm -f $k; exit $s' % (
+                    self._get_str_target_property(to_target, 'port', 22), shell_quote(source_file),
+                    shell_quote('%s@%s:%s' % (to.username, host, destination_file))),
+                from_target, exec_id, stdin=lambda f: f.write(to_bytes(private_key)))
+            self._execute_checked(destination, 'chmod %o %s' % (int(mode, 8), shell_quote(destination_file)),
+                                  to_target, exec_id)
+            copied = True
+        finally:
+            try:
+                self._execute_checked(destination, "sed -i '/ %s$/d' ~/.ssh/authorized_keys" % comment,
+                                      to_target, exec_id)
+            except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                message = 'Removing temporary key "%s" from target "%s" failed: %s' % (comment, to_target, e)
+                if copied:
+                    raise _DirectCopyCleanupError(message)
+                error(message)
+
+    def _execute_checked(self, connection, command, target, exec_id, stdin=None):
+        """
+        Executes _command_ in _connection_ of the current transaction and
+        raises ExecutionError if the exit status is not zero.
+        """
+        current = self._thread_local.connection
+        self._thread_local.connection = connection
+        try:
+            result = self._execute_impl(command, target, exec_id, stdin=stdin)
+        finally:
+            self._thread_local.connection = current
+        if result.status != '0':
+            raise ExecutionError('Command "%s" failed in target "%s": %s' % (command, target, result))
+        return result
 
     def put_file(self, source_file, destination_dir, mode, target, exec_id, timeout):
         self._start_thread(exec_id, target, self._put_file_impl,
@@ -270,7 +752,9 @@ class BaseEngine(object):
         self._debug(''.join(
             ['Copying file "', source_file, '" to target "', target,
              ':', destination_dir, '" (cwd: ', os.getcwd(), ')']))
-        self._thread_local.connection.put_file(source_file, destination_dir, mode)
+        chunked = self._get_chunked_transfer(target)
+        self._run_resumable(target, lambda resume: self._thread_local.connection.put_file(
+            source_file, destination_dir, mode, chunked, resume))
         return Result.SUCCESS
 
     def get_file(self, source_file, destination, target, exec_id, timeout):
@@ -282,15 +766,58 @@ class BaseEngine(object):
         self._debug(''.join(
             ['Copying file from target "', target, ':', source_file, '" to "',
              destination, '" (cwd: ', os.getcwd(), ')']))
-        self._thread_local.connection.get_file(source_file, destination)
+        chunked = self._get_chunked_transfer(target)
+        self._run_resumable(target, lambda resume: self._thread_local.connection.get_file(
+            source_file, destination, chunked, resume))
         return Result.SUCCESS
 
+    def _get_chunked_transfer(self, target):
+        return ChunkedTransfer(self._get_int_target_property(target, 'parallel transfer threshold'),
+                               self._get_int_target_property(target, 'parallel transfer chunk size'),
+                               self._get_int_target_property(target, 'parallel transfer channels'))
+
+    def _run_resumable(self, target, transfer):
+        """
+        Calls _transfer_(resume) where resume is target property _resume
+        transfers_. If resume is True and the SFTP connection breaks during
+        the transfer, reconnects and calls _transfer_ again to continue from
+        the partial copy at most _max connection attempts_ times. The current
+        connection is reopened with the thread local reconnect callback if it
+        is set and otherwise by restarting the transaction to _target_.
+        """
+        resume = self._get_bool_target_property(target, 'resume transfers')
+        attempts = 1
+        while True:
+            try:
+                return transfer(resume)
+            except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                if (not resume or self.targets[target].protocol not in ['ssh/sftp', 'ssh']
+                        or self._thread_local.connection.is_alive()
+                        or self._thread_local.runner.interrupted
+                        or self._thread_local.transaction_level != 1
+                        or attempts >= self._get_int_target_property(target, 'max connection attempts')):
+                    raise
+                attempts += 1
+                self._debug('Connection to target "%s" broke during file transfer (%s), resuming' % (target, e))
+                if not (self._thread_local.reconnect or self._reconnect_transaction)(target):
+                    raise e
+
+    def _reconnect_transaction(self, target):
+        self._stop_transaction()
+        return self._start_transaction([target])
+
     def put_dir(self, source_dir, target_dir, mode, target, exec_id, timeout):
         self._start_thread(exec_id, target, self._put_dir_impl,
                            [source_dir, target_dir, mode, target, exec_id])
         return self._join_thread(exec_id, timeout)
 
     def _put_dir_impl(self, source_dir, target_dir, mode, target, exec_id):
+        transfer = self._get_str_target_property(target, 'directory transfer').lower()
+        if transfer not in ['file', 'tar', 'tar.gz']:
+            raise ValueError('Unsupported directory transfer "' + transfer + '"')
+        if transfer != 'file' and self._has_tar_streaming(target):
+            compress = transfer == 'tar.gz' and self._thread_local.connection.has_command('gzip')
+            return self._put_dir_tar_impl(source_dir, target_dir, mode, target, exec_id, compress)
         self._mkdir_impl(target_dir, mode, target, exec_id)
         for root, dirs, files in os.walk(source_dir):
             current_target_dir = os.path.join(target_dir,
@@ -304,6 +831,225 @@ class BaseEngine(object):
                 self._debug("Created directory " + os.path.join(current_target_dir, d))
         return Result.SUCCESS
 
+    def _has_tar_streaming(self, target):
+        connection = self._thread_local.connection
+        if connection.supports_stdin() and connection.has_command('tar'):
+            return True
+        self._debug('tar streaming is not available in target "' + target + '", copying files one by one')
+        return False
+
+    def _put_dir_tar_impl(self, source_dir, target_dir, mode, target, exec_id, compress, paths=None):
+        self._debug(''.join(
+            ['Streaming directory "', source_dir, '" to target "', target,
+             ':', target_dir, '" (cwd: ', os.getcwd(), ')']))
+        mode = int(mode, 8)
+        result = self._execute_impl(
+            'umask 0000; mkdir -p -m %o %s && tar -x%sf - -C %s' % (
+                mode, shell_quote(target_dir), 'z' if compress else '', shell_quote(target_dir)), target, exec_id,
+            stdin=lambda f: tarstream.write_tree(f, source_dir, mode, compress, paths))
+        if result.status != '0':
+            raise ExecutionError('Extracting directory to "%s:%s" failed: %s' % (target, target_dir, result))
+        return Result.SUCCESS
+
+    def sync_dir(self, source_dir, target_dir, mode, compare, delete, target, exec_id, timeout):
+        self._start_thread(exec_id, target, self._sync_dir_impl,
+                           [source_dir, target_dir, mode, compare, delete, target, exec_id])
+        return self._join_thread(exec_id, timeout)
+
+    _SYNC_LISTING_COMMANDS = {
+        'size': "find . -type f -exec stat -c 'f %s %Y %n' {} +",
+        'mtime': "find . -type f -exec stat -c 'f %s %Y %n' {} +",
+        'md5': "find . -type f -exec md5sum {} + | sed 's/^/f /'"}
+
+    def _sync_dir_impl(self, source_dir, target_dir, mode, compare, delete, target, exec_id):
+        compare = str(compare).lower()
+        if compare not in self._SYNC_LISTING_COMMANDS:
+            raise ValueError('Unsupported compare "' + compare + '"')
+        local_dirs, local_files = self._list_local_tree(source_dir)
+        self._mkdir_impl(target_dir, mode, target, exec_id)
+        remote_dirs, remote_files = self._list_remote_tree(target_dir, compare, target, exec_id)
+        sent = list()
+        skipped = list()
+        for name in sorted(local_files):
+            unchanged = self._is_unchanged(local_files[name], remote_files.get(name), compare)
+            (skipped if unchanged else sent).append(name)
+        self._debug('Syncing directory "%s" to target "%s:%s": %d changed, %d unchanged files' % (
+            source_dir, target, target_dir, len(sent), len(skipped)))
+        for name in sorted(set(local_dirs) - set(remote_dirs)):
+            self._mkdir_impl(pathops.join(target_dir, name), mode, target, exec_id)
+        if sent:
+            self._sync_files(source_dir, target_dir, mode, sent, target, exec_id)
+        deleted = list()
+        if BuiltIn().convert_to_boolean(delete):
+            deleted = self._get_extraneous(local_dirs, local_files, remote_dirs, remote_files)
+            self._remove_remote_paths(target_dir, deleted, target, exec_id)
+        return SyncResult(sent, skipped, deleted,
+                          sum(local_files[name][1] for name in sent),
+                          sum(local_files[name][1] for name in skipped))
+
+    @staticmethod
+    def _list_local_tree(source_dir):
+        """
+        Returns list of the directories and dictionary <file, (path, size,
+        mtime)> of the files under _source_dir_ named relative to it.
+        """
+        dirs = list()
+        files = dict()
+        for root, dir_names, file_names in os.walk(source_dir):
+            for d in dir_names:
+                dirs.append(os.path.relpath(os.path.join(root, d), source_dir).replace(os.sep, '/'))
+            for f in file_names:
+                path = os.path.join(root, f)
+                stat = os.stat(path)
+                files[os.path.relpath(path, source_dir).replace(os.sep, '/')] = (
+                    path, stat.st_size, int(stat.st_mtime))
+        return dirs, files
+
+    def _list_remote_tree(self, target_dir, compare, target, exec_id):
+        """
+        Returns list of the directories and dictionary of the files under
+        _target_dir_ named relative to it. The files are mapped to (size,
+        mtime) or to MD5 checksum depending on _compare_. The tree is
+        listed with one command. Missing _target_dir_ is listed as empty.
+        """
+        result = self._execute_impl(
+            "test -d %s || exit 0; cd %s && find . -mindepth 1 -type d | sed 's/^/d /' && %s" % (
+                shell_quote(target_dir), shell_quote(target_dir), self._SYNC_LISTING_COMMANDS[compare]),
+            target, exec_id, output=OutputCollector())
+        if result.status != '0':
+            raise ExecutionError('Listing directory "%s:%s" failed: %s' % (target, target_dir, result))
+        dirs = list()
+        files = dict()
+        for line in result.stdout.splitlines():
+            if line.startswith('d ./'):
+                dirs.append(line[4:])
+            elif compare == 'md5':
+                checksum, name = line[2:].split('  ./', 1)
+                files[name] = checksum
+            else:
+                size, mtime, name = line[2:].split(' ', 2)
+                files[name[2:]] = (int(size), int(mtime))
+        return dirs, files
+
+    def _is_unchanged(self, local, remote, compare):
+        path, size, mtime = local
+        if remote is None:
+            return False
+        if compare == 'md5':
+            return remote == self._get_file_digest(path, 'md5')
+        if compare == 'size':
+            return remote[0] == size
+        # Copied files get the local modification time in the target
+        return remote[0] == size and mtime == remote[1]
+
+    @staticmethod
+    def _get_file_digest(path, algorithm):
+        digest = hashlib.new(algorithm)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _sync_files(self, source_dir, target_dir, mode, names, target, exec_id):
+        transfer = self._get_str_target_property(target, 'directory transfer').lower()
+        if transfer != 'file' and self._has_tar_streaming(target):
+            compress = transfer == 'tar.gz' and self._thread_local.connection.has_command('gzip')
+            self._put_dir_tar_impl(source_dir, target_dir, mode, target, exec_id, compress, set(names))
+            return
+        for name in names:
+            self._put_file_impl(os.path.join(source_dir, *name.split('/')),
+                                pathops.directorize(pathops.join(target_dir, posixpath.dirname(name))),
+                                mode, target, exec_id)
+        self._set_remote_mtimes(source_dir, target_dir, names, target, exec_id)
+
+    def _set_remote_mtimes(self, source_dir, target_dir, names, target, exec_id, batch_size=200):
+        """
+        Sets the modification times of the local files to the files copied
+        one by one. Extracting the tar stream sets them already.
+        """
+        for i in range(0, len(names), batch_size):
+            touches = list()
+            for name in names[i:i + batch_size]:
+                mtime = int(os.stat(os.path.join(source_dir, *name.split('/'))).st_mtime)
+                touches.append('touch -c -m -d @%d -- %s' % (mtime, shell_quote(name)))
+            command = 'cd %s && %s' % (shell_quote(target_dir), ' && '.join(touches))
+            result = self._execute_impl(command, target, exec_id)
+            if result.status != '0':
+                raise ExecutionError('Setting modification times in "%s:%s" failed: %s' % (
+                    target, target_dir, result))
+
+    @staticmethod
+    def _get_extraneous(local_dirs, local_files, remote_dirs, remote_files):
+        """
+        Returns the remote paths missing locally excluding the contents of
+        extraneous directories.
+        """
+        local = set(local_dirs) | set(local_files)
+        extraneous = list()
+        for name in sorted(set(remote_dirs) | set(remote_files)):
+            if name in local:
+                continue
+            if extraneous and name.startswith(extraneous[-1] + '/'):
+                continue
+            extraneous.append(name)
+        return extraneous
+
+    def _remove_remote_paths(self, target_dir, names, target, exec_id, batch_size=200):
+        for i in range(0, len(names), batch_size):
+            command = 'cd %s && rm -rf -- %s' % (
+                shell_quote(target_dir), ' '.join(shell_quote(name) for name in names[i:i + batch_size]))
+            result = self._execute_impl(command, target, exec_id)
+            if result.status != '0':
+                raise ExecutionError('Removing files from "%s:%s" failed: %s' % (target, target_dir, result))
+        self._thread_local.connection.forget_dirs()
+
+    def get_dir(self, source_dir, destination_dir, include, exclude, target, exec_id, timeout):
+        self._start_thread(exec_id, target, self._get_dir_impl,
+                           [source_dir, destination_dir, include, exclude, target, exec_id])
+        return self._join_thread(exec_id, timeout)
+
+    def _get_dir_impl(self, source_dir, destination_dir, include, exclude, target, exec_id):
+        connection = self._thread_local.connection
+        if not (connection.supports_stdin() and connection.has_command('tar')):
+            raise ExecutionError('Copying directory from target "' + target + '" requires tar over SSH')
+        compress = (self._get_str_target_property(target, 'directory transfer').lower() == 'tar.gz'
+                    and connection.has_command('gzip'))
+        self._debug(''.join(
+            ['Streaming directory from target "', target, ':', source_dir, '" to "',
+             destination_dir, '" (cwd: ', os.getcwd(), ')']))
+        output = tarstream.ExtractingOutput(destination_dir)
+        # Empty standard input runs the command without terminal which
+        # would mangle the binary archive.
+        result = self._execute_impl(
+            'set -o pipefail; cd %s && %s | tar -c%sf - --no-recursion -T -' % (
+                shell_quote(source_dir), self._get_find_command(include, exclude), 'z' if compress else ''),
+            target, exec_id, output=output, stdin=lambda f: None)
+        if result.status != '0':
+            raise ExecutionError('Archiving directory "%s:%s" failed: %s' % (target, source_dir, result))
+        if output.error is not None:
+            raise ExecutionError('Extracting directory from "%s:%s" failed: %s' % (
+                target, source_dir, output.error))
+        return Result.SUCCESS
+
+    def _get_find_command(self, include, exclude):
+        """
+        Returns find command listing the paths to archive. Directories
+        and files matching _exclude_ patterns are pruned. If _include_
+        patterns are given, only the files matching them are listed.
+        """
+        command = 'find . -mindepth 1'
+        exclude = self._split_list(exclude)
+        if exclude:
+            command += ' %s -prune -o' % self._get_name_test(exclude)
+        include = self._split_list(include)
+        if include:
+            command += ' %s ! -type d' % self._get_name_test(include)
+        return command + ' -print'
+
+    @staticmethod
+    def _get_name_test(patterns):
+        return '\\( ' + ' -o '.join('-name ' + shell_quote(p) for p in patterns) + ' \\)'
+
     def mkdir(self, path, mode, target, exec_id, timeout):
         self._start_thread(exec_id, target, self._mkdir_impl, [path, mode, target, exec_id])
         return self._join_thread(exec_id, timeout)
@@ -322,12 +1068,94 @@ class BaseEngine(object):
         self._thread_local.connection.rmdir(path)
         return Result.SUCCESS
 
-    def _start_thread(self, exec_id, targets, command, args):
+    _BENCHMARK_COMMANDS = 5
+    _BENCHMARK_TEXT = b'0123456789 abcdefghijklmnopqrstuvwxyz benchmark output line\n' * 16384
+
+    def benchmark(self, target, size, compressible, variants, exec_id, timeout):
+        """
+        Measures connection setup, command latency and file transfer rates
+        of _target_ with its current properties and with the properties of
+        each dictionary in _variants_ applied on top of them.
+        """
+        self._check_target(target)
+        size = int(size)
+        local_file = self._create_benchmark_file(size, BuiltIn().convert_to_boolean(compressible))
+        runs = list()
+        try:
+            for settings in [dict()] + list(variants or []):
+                name = '%s-benchmark-%s' % (target, exec_id)
+                self.targets[name] = copy.copy(self.targets[target])
+                self.targets[name].properties = dict(self.targets[target].properties)
+                self.targets[name].properties.update(settings)
+                self.targets[name].properties.update({'persistent connection': False,
+                                                      'max channels per connection': 1})
+                try:
+                    start = time.time()
+                    self._start_thread(exec_id, name, self._benchmark_impl, [local_file, name, exec_id])
+                    run = self._join_thread(exec_id, timeout)
+                finally:
+                    del self.targets[name]
+                if not isinstance(run, dict):
+                    raise ExecutionError('Connection to target "%s" failed with settings %s' % (target, settings))
+                run['connect'] = time.time() - start - run.pop('elapsed')
+                run['settings'] = dict(settings)
+                runs.append(run)
+        finally:
+            os.remove(local_file)
+        return BenchmarkResult(size, runs)
+
+    def _create_benchmark_file(self, size, compressible):
+        fd, path = tempfile.mkstemp(prefix='benchmark-', dir=self._get_local_tempdir())
+        with os.fdopen(fd, 'wb') as fileobj:
+            remaining = size
+            while remaining > 0:
+                length = min(len(BaseEngine._BENCHMARK_TEXT), remaining)
+                fileobj.write(BaseEngine._BENCHMARK_TEXT[:length] if compressible else os.urandom(length))
+                remaining -= length
+        return path
+
+    def _benchmark_impl(self, local_file, target, exec_id):
+        start = time.time()
+        latencies = list()
+        for _ in range(BaseEngine._BENCHMARK_COMMANDS):
+            command_start = time.time()
+            self._thread_local.connection.execute_command('true')
+            latencies.append(time.time() - command_start)
+        remote_dir = pathops.directorize(
+            pathops.append(self._get_str_target_property(target, 'tempdir'), '-' + exec_id))
+        local_copy = local_file + '.copy'
+        self._mkdir_impl(remote_dir, oct(0o700), target, exec_id)
+        try:
+            transfer_start = time.time()
+            self._put_file_impl(local_file, remote_dir, oct(0o600), target, exec_id)
+            upload = time.time() - transfer_start
+            transfer_start = time.time()
+            self._get_file_impl(pathops.join(remote_dir, os.path.basename(local_file)), local_copy, target, exec_id)
+            download = time.time() - transfer_start
+        finally:
+            self._thread_local.connection.execute_command('rm -rf ' + remote_dir)
+            if os.path.exists(local_copy):
+                os.remove(local_copy)
+        return {'latency': sorted(latencies)[len(latencies) // 2], 'upload': upload, 'download': download,
+                'elapsed': time.time() - start}
+
+    def _start_thread(self, exec_id, targets, command, args, callback=None, block=True):
+        """
+        Starts execution _exec_id_. If _callback_ is given, it is called
+        with the runner from the worker thread when the execution has
+        finished. If _block_ is False and the execution queue is full,
+        raises _ExecutionError_ instead of waiting for room in the queue.
+        """
         exec_id = str(exec_id)
         if self._threads.get(exec_id):
             raise ExecutionError('Execution with ID "' + exec_id + '" is already running')
-        self._threads[exec_id] = _ExecutionRunner(targets, command, args, self)
-        self._threads[exec_id].start()
+        self._threads[exec_id] = _ExecutionRunner('Execution-' + exec_id, targets, command, args, self,
+                                                  callback)
+        try:
+            self._threads[exec_id].start(block)
+        except queue.Full:
+            self._threads[exec_id] = None
+            raise ExecutionError('Execution with ID "' + exec_id + '" rejected: execution queue is full')
 
     def _join_thread(self, exec_id, timeout=None):
         try:
@@ -341,7 +1169,7 @@ class BaseEngine(object):
             if self._threads[exec_id].is_alive():
                 timed_out = True
                 self._threads[exec_id].interrupt()
-                self._threads[exec_id].join(5)
+                self._threads[exec_id].join(BaseEngine._INTERRUPT_TIMEOUT)
                 if self._threads[exec_id].is_alive():
                     raise TimeoutError(
                         'Execution ID "' + exec_id + '" timed out: failed to interrupt running thread')
@@ -390,7 +1218,7 @@ class BaseEngine(object):
         connection = None
         while not connection:
             try:
-                connection = self.__create_new_connection(target_name)
+                connection = self.__get_connection(target_name)
                 break
             except (ValueError, SSHException, IOError):
                 connection_attempts += 1
@@ -410,17 +1238,81 @@ class BaseEngine(object):
         self._thread_local.connection = connection
         self._thread_local.connections.append(connection)
         # Purpose of this is that we can call connection.close()
-        # from main thread when executing thread is blocked in
+        # from main thread when executing worker is blocked in
         # connection.read_command_output()
-        threading.currentThread().connections.append(connection)
+        self._thread_local.runner.connections.append(connection)
 
     def __disconnect(self):
         for con in self._thread_local.connections:
-            con.close_connection()
+            if not self._connection_pool.release(con):
+                con.close_connection()
         self._thread_local.transaction_level = 0
         self._thread_local.connections = list()
         self._thread_local.connection = None
 
+    def __get_connection(self, target_name):
+        if self.targets[target_name].protocol not in ['ssh/sftp', 'ssh', 'ssh/scp']:
+            return self.__create_new_connection(target_name)
+        persistent = self._get_bool_target_property(target_name, 'persistent connection')
+        max_channels = int(self._get_int_target_property(target_name, 'max channels per connection'))
+        with self._shared_channels_lock:
+            shared = self._shared_channels.get(target_name, [])
+            max_channels = max([max_channels] + shared)
+        if not persistent and max_channels < 2:
+            return self.__create_new_connection(target_name)
+        ttl = 0
+        if persistent or shared:
+            ttl = self._get_int_target_property(target_name, 'connection idle timeout')
+        key = self._get_connection_key(target_name)
+        connection = self._connection_pool.acquire(key, ttl, max_channels)
+        if connection is None:
+            try:
+                connection = self.__create_new_connection(target_name)
+            except Exception:
+                self._connection_pool.cancel(key)
+                raise
+            self._connection_pool.add(key, connection, ttl)
+        return connection
+
+    @contextlib.contextmanager
+    def _shared_connection(self, target_name, channels):
+        """
+        Lets the executions in _target_name_ share SSH connections over
+        up to _channels_ channels while the context is active. The shared
+        connections stay open between the executions and are closed at
+        the end unless the target has persistent connections.
+        """
+        with self._shared_channels_lock:
+            self._shared_channels.setdefault(target_name, []).append(channels)
+        try:
+            yield
+        finally:
+            with self._shared_channels_lock:
+                self._shared_channels[target_name].remove(channels)
+                last = not self._shared_channels[target_name]
+                if last:
+                    del self._shared_channels[target_name]
+            if last and not self._get_bool_target_property(target_name, 'persistent connection'):
+                self._connection_pool.expire(self._get_connection_key(target_name))
+
+    def _get_connection_key(self, target_name):
+        target = self.targets[target_name]
+        props = self.get_target_properties(target_name)
+        return (target.protocol, target.host, str(props.get('port')), target.username,
+                target.password, target.sshkeyfile, props.get('su username'),
+                props.get('su password'), bool(props.get('use sudo user')),
+                tuple(sorted((name, str(value))
+                             for name, value in self._get_transport_options(target_name).items())))
+
+    def _get_transport_options(self, target_name):
+        props = self.get_target_properties(target_name)
+        return {'compress': self._get_bool_target_property(target_name, 'ssh compression'),
+                'ciphers': self._split_list(props.get('ssh ciphers')),
+                'macs': self._split_list(props.get('ssh macs')),
+                'kex': self._split_list(props.get('ssh kex')),
+                'window_size': props.get('ssh window size'),
+                'max_packet_size': props.get('ssh max packet size')}
+
     def __create_new_connection(self, target_name):
         target = self.targets[target_name]
         connection = None
@@ -438,6 +1330,8 @@ class BaseEngine(object):
             default_port = 21
         else:
             raise ValueError('Unsupported protocol ' + target.protocol)
+        if target.protocol in ['ssh/sftp', 'ssh', 'ssh/scp']:
+            connection.set_transport_options(**self._get_transport_options(target_name))
 
         connection.open_connection(target.host,
                                    port=self._get_str_target_property(target_name, 'port', default_port),
@@ -445,13 +1339,7 @@ class BaseEngine(object):
                                    prompt=self._get_str_target_property(target_name, 'prompt'),
                                    prompt_is_regexp=self._get_bool_target_property(target_name, 'prompt is regexp'))
 
-        if target.protocol in ['ssh/sftp', 'ssh', 'ssh/scp'] and target.sshkeyfile is not None:
-            connection.login_with_key(target.username, target.sshkeyfile)
-        else:
-            connection.login(target.username,
-                             target.password,
-                             self._get_str_target_property(target_name, 'login prompt'),
-                             self._get_str_target_property(target_name, 'password prompt'))
+        self._login_connection(connection, target_name, target.username, target.password, target.sshkeyfile)
         props = self.get_target_properties(target_name)
         su_username = props.get('su username')
         su_password = props.get('su password')
@@ -463,14 +1351,23 @@ class BaseEngine(object):
         self._set_use_sudo_user_if_needed(props, connection)
         return connection
 
+    def _login_connection(self, connection, target_name, username, password, sshkeyfile):
+        if self.targets[target_name].protocol in ['ssh/sftp', 'ssh', 'ssh/scp'] and sshkeyfile is not None:
+            connection.login_with_key(username, sshkeyfile)
+        else:
+            connection.login(username,
+                             password,
+                             self._get_str_target_property(target_name, 'login prompt'),
+                             self._get_str_target_property(target_name, 'password prompt'))
+
     @staticmethod
     def _set_use_sudo_user_if_needed(props, connection):
         if props.get('use sudo user'):
             connection.set_use_sudo_user()
 
     def _debug(self, message):
-        msg = threading.currentThread().getName() + ' ' + message
-        if threading.currentThread() == self._main_thread:
-            debug(msg)
+        runner = getattr(self._thread_local, 'runner', None)
+        if runner is None:
+            debug(threading.current_thread().getName() + ' ' + message)
         else:
-            self._thread_local.messages.append(msg)
+            self._thread_local.messages.append(runner.name + ' ' + message)
@@ -0,0 +1,70 @@
+import threading
+from logging import debug
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+class ChunkedTransfer(object):
+    """
+    Settings of parallel chunked file transfers.
+
+    Files of at least _threshold_ bytes are transferred in byte ranges of
+    _chunk_size_ bytes over _channels_ sessions concurrently. Threshold 0
+    or less than two channels disables chunked transfers.
+    """
+
+    def __init__(self, threshold, chunk_size, channels):
+        self.threshold = int(threshold)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.channels = int(channels)
+
+    def applies(self, size):
+        return self.channels > 1 and 0 < self.threshold <= size
+
+    def run(self, size, open_session, close_session, transfer_range):
+        """
+        Calls _transfer_range_(session, offset, length) for each chunk of
+        _size_ bytes. The chunks are shared by _channels_ threads each
+        using its own session opened with _open_session_ and closed with
+        _close_session_(session, failed). The first error is raised after
+        the threads have stopped.
+        """
+        chunks = queue.Queue()
+        for offset in range(0, size, self.chunk_size):
+            chunks.put((offset, min(self.chunk_size, size - offset)))
+        errors = list()
+
+        def work():
+            try:
+                session = open_session()
+            except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                errors.append(e)
+                return
+            try:
+                while not errors:
+                    try:
+                        offset, length = chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    transfer_range(session, offset, length)
+            except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                errors.append(e)
+            finally:
+                close_session(session, bool(errors))
+
+        workers = [threading.Thread(target=work, name='RemoteScriptChunk-%d' % i)
+                   for i in range(min(self.channels, chunks.qsize()))]
+        debug('Transferring %d bytes in %d chunks over %d sessions' % (size, chunks.qsize(), len(workers)))
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
@@ -2,6 +2,12 @@
 import sys
 import codecs
 
+try:
+    from shlex import quote as shell_quote  # noqa: F401
+except ImportError:  # Python 2
+    from pipes import quote as shell_quote  # noqa: F401
+
+
 __copyright__ = 'Copyright (C) 2019, Nokia'
 
 
@@ -7,6 +7,7 @@ import tempfile
 import ftplib
 from ftplib import FTP as PythonFTP
 from robot.libraries import Telnet as RobotTelnet
+from crl.remotescript.output import STDOUT
 from crl.remotescript.result import Result
 
 if sys.platform.startswith('java'):
@@ -50,7 +51,21 @@ class ConnectionMediator(object):
     def close_connection(self):
         self.lib.close_connection()
 
-    def execute_command(self, command):
+    def close_channels(self, owner):
+        self.close_connection()
+
+    @staticmethod
+    def is_alive():
+        return False
+
+    @staticmethod
+    def supports_stdin():
+        return False
+
+    def generate_key(self, comment):
+        raise NotImplementedError()
+
+    def execute_command(self, command, output=None):
         raise NotImplementedError()
 
     def mkdir(self, path, mode):
@@ -61,20 +76,23 @@ class ConnectionMediator(object):
         # TBD: This should verify exit status (and execute_command should provide it)
         self.execute_command("rm -rf " + path)
 
-    def put_file(self, src, dst, mode):
+    def forget_dirs(self):
+        pass
+
+    def put_file(self, src, dst, mode, chunked=None, resume=False):
         raise NotImplementedError()
 
-    def get_file(self, src, dst):
+    def get_file(self, src, dst, chunked=None, resume=False):
         raise NotImplementedError()
 
-    def copy_file(self, to_connection, src, dst_dir, mode):
+    def copy_file(self, to_connection, src, dst_dir, mode, window=None):
         src_filename = src
         src_filename.replace('/', os.sep)
         src_filename = os.path.basename(src_filename)
         mode = int(mode, 8)
         to_fd = to_connection.get_remote_fd(dst_dir, src_filename)
         try:
-            self.remote_copy(src, to_fd)
+            self.remote_copy(src, to_fd, window)
             to_fd.chmod(mode)
         finally:
             to_fd.close()
@@ -83,7 +101,7 @@ class ConnectionMediator(object):
     def get_remote_fd(self, directory, filename):
         raise NotImplementedError()
 
-    def remote_copy(self, src, to_fd):
+    def remote_copy(self, src, to_fd, window=None):
         raise NotImplementedError()
 
 
@@ -105,21 +123,26 @@ class Telnet(ConnectionMediator):
     def login(self, username, password, login_prompt, password_prompt):
         self.lib.login(username, password, login_prompt, password_prompt)
 
-    def execute_command(self, command):
+    def execute_command(self, command, output=None):
         status = Result.UNKNOWN_STATUS
         out = self.lib.execute_command(command + '; ' + Telnet.EXIT_STATUS_CMD)
         out = out.rstrip()
         # pylint: disable=anomalous-backslash-in-string
-        output = re.match("^(.*)\n(\d+)$", out, re.DOTALL)  # noqa: W605
-        if output:
-            out = output.group(1).strip()
-            status = output.group(2)
+        match = re.match("^(.*)\n(\d+)$", out, re.DOTALL)  # noqa: W605
+        if match:
+            out = match.group(1).strip()
+            status = match.group(2)
+        if output is not None:
+            output.write(STDOUT, out)
+            output.close()
+            return status, output.stdout, output.stderr
         return status, out, ''
 
 
 class SSH(ConnectionMediator):
     def __init__(self):
         self._lib = SSHClient()
+        self._commands = dict()  # <command name, available in remote host>
 
     @property
     def lib(self):
@@ -134,35 +157,76 @@ class SSH(ConnectionMediator):
     def set_use_sudo_user(self):
         self.lib.set_use_sudo_user()
 
+    def set_transport_options(self, **options):
+        self.lib.set_transport_options(**options)
+
+    def open_tunneled_connection(self, gateway, host, port, timeout):
+        """
+        Prepares connection to _host_ over a direct-tcpip channel of
+        connection _gateway_.
+        """
+        self.lib.open_connection(host, port, timeout, sock=gateway.lib.open_tunnel(host, port))
+
     def get_su_username(self):
         return self.lib.get_su_username()
 
     def get_su_command(self, command):
         return self.lib.get_su_command(command)
 
-    def execute_command(self, command):
-        return self.lib.execute_command(command)
+    def is_alive(self):
+        return self.lib.is_alive()
+
+    def generate_key(self, comment):
+        return self.lib.generate_key(comment)
+
+    def supports_stdin(self):
+        return self.lib.STDIN_SUPPORTED
+
+    def close_channels(self, owner):
+        self.lib.close_channels(owner)
+
+    def execute_command(self, command, output=None, stdin=None):
+        if stdin is None:
+            return self.lib.execute_command(command, output)
+        return self.lib.execute_command(command, output, stdin)
+
+    def has_command(self, name):
+        """
+        Returns True if command _name_ is available in the remote host.
+        The result is cached for the lifetime of the connection.
+        """
+        if name not in self._commands:
+            status, _, _ = self.lib.execute_command('command -v ' + name + ' >/dev/null 2>&1')
+            self._commands[name] = status == '0'
+        return self._commands[name]
+
+    def rmdir(self, path):
+        super(SSH, self).rmdir(path)
+        self.forget_dirs()
+
+    def forget_dirs(self):
+        self.lib.forget_dirs()
 
-    def put_file(self, src, dst, mode):
-        self.lib.put_file(src, dst, mode)
+    def put_file(self, src, dst, mode, chunked=None, resume=False):
+        self.lib.put_file(src, dst, mode, chunked, resume)
 
-    def get_file(self, src, dst):
+    def get_file(self, src, dst, chunked=None, resume=False):
         if os.path.isdir(dst):
             dst = os.path.join(dst, os.path.basename(src))
-        self.lib.get_file(src, dst)
+        self.lib.get_file(src, dst, chunked, resume)
 
     def get_remote_fd(self, directory, filename):
         return self.lib.get_remote_fd(directory, filename)
 
-    def remote_copy(self, src, to_fd):
-        self.lib.copy_file(src, to_fd)
+    def remote_copy(self, src, to_fd, window=None):
+        self.lib.copy_file(src, to_fd, window)
 
 
 class SSH_SCP(SSH):
-    def put_file(self, src, dst, mode):
+    def put_file(self, src, dst, mode, chunked=None, resume=False):
         self.lib.get_scp_client().put(src, dst, mode)
 
-    def get_file(self, src, dst):
+    def get_file(self, src, dst, chunked=None, resume=False):
         if os.path.isdir(dst):
             (mydst, myfile) = (dst, '')
         else:
@@ -173,7 +237,7 @@ class SSH_SCP(SSH):
             shutil.move(os.path.join(mydst, os.path.basename(src)), dst)
             os.rmdir(mydst)
 
-    def copy_file(self, to_connection, src, dst_dir, mode):
+    def copy_file(self, to_connection, src, dst_dir, mode, window=None):
         raise NotImplementedError()
 
 
@@ -220,13 +284,13 @@ class FTP(ConnectionMediator):
     def rmdir(self, path):
         self.lib.rmd(path)
 
-    def put_file(self, src, dst, mode):
+    def put_file(self, src, dst, mode, chunked=None, resume=False):
         self.lib.cwd(dst)
         fh = open(src, 'rb')
         self.lib.storbinary('STOR ' + os.path.basename(src), fh)
         fh.close()
 
-    def get_file(self, src, dst):
+    def get_file(self, src, dst, chunked=None, resume=False):
         # If the destination is a directory, we can just copy the file into it.
         if os.path.isdir(dst):
             (mydst, myfile) = (dst, '')
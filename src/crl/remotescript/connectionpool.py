@@ -0,0 +1,208 @@
+import threading
+import time
+from logging import debug
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+class _PooledConnection(object):
+
+    def __init__(self, key, connection, ttl, parent=None):
+        self.key = key
+        self.connection = connection
+        self.ttl = ttl
+        self.parent = parent
+        self.leases = 1
+        self.last_used = time.time()
+
+    def is_expired(self, now):
+        return not self.leases and now - self.last_used > self.ttl
+
+
+class ConnectionPool(object):
+    """
+    Pool of authenticated connections keyed by target identity.
+
+    Connections are leased with `acquire` and returned with `release`.
+    A connection may be leased by several executions at the same time
+    if the connection multiplexes the executions over separate channels.
+    Idle connections are health checked before they are handed out
+    again and they are closed when they have been idle longer than
+    their time-to-live.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._entries = dict()  # <connection key, list of _PooledConnection>
+        self._connecting = dict()  # <connection key, number of connections being opened>
+
+    def acquire(self, key, ttl, max_leases=1):
+        """
+        Leases connection for _key_ from the pool.
+
+        At most _max_leases_ executions may lease the same connection
+        at the same time. If there is no suitable connection in the pool
+        None is returned and the caller must open a new connection and
+        either `add` it to the pool or `cancel` the acquisition. If
+        a shared connection is already being opened for _key_, waits
+        for it instead of returning None.
+
+        _ttl_ is the time in seconds the connection may stay idle in the
+        pool after the last lease is released. Zero _ttl_ closes the
+        connection when it is no longer leased.
+        """
+        while True:
+            with self._condition:
+                expired = self._pop_expired()
+                entry = self._select(key, max_leases)
+                waiting = entry is None and max_leases > 1 and key in self._connecting
+                if waiting and not expired:
+                    self._condition.wait()
+                elif entry is None and not waiting:
+                    self._connecting[key] = self._connecting.get(key, 0) + 1
+                elif entry is not None:
+                    entry.leases += 1
+            self._close_entries(expired)
+            if waiting:
+                continue
+            if entry is None:
+                return None
+            if entry.connection.is_alive():
+                with self._condition:
+                    entry.ttl = ttl
+                debug('Reusing pooled connection %s (%d leases)' % (str(key[:4]), entry.leases))
+                return entry.connection
+            self._discard(entry)
+
+    def add(self, key, connection, ttl, parent=None):
+        """
+        Adds new _connection_ leased by the caller to the pool.
+
+        _parent_ is a pooled connection _connection_ is tunneled over.
+        The parent stays leased as long as _connection_ is in the pool.
+        """
+        with self._condition:
+            self._stop_connecting(key)
+            if parent is not None:
+                self._find(parent).leases += 1
+            self._entries.setdefault(key, []).append(_PooledConnection(key, connection, ttl, parent))
+            self._condition.notify_all()
+
+    def cancel(self, key):
+        """
+        Cancels acquisition of a new connection for _key_.
+        """
+        with self._condition:
+            self._stop_connecting(key)
+            self._condition.notify_all()
+
+    def release(self, connection):
+        """
+        Returns leased _connection_ to the pool. The connection is closed
+        if it is no longer alive or if it is not leased anymore and it
+        has zero time-to-live.
+
+        *Returns:*\n
+        True if _connection_ is owned by the pool, False otherwise.
+        """
+        entry = self._find(connection)
+        if entry is None:
+            return False
+        if not connection.is_alive():
+            self._discard(entry)
+            return True
+        with self._condition:
+            entry.leases -= 1
+            entry.last_used = time.time()
+            if not entry.leases and entry.ttl <= 0:
+                self._remove(entry)
+                self._condition.notify_all()
+                expired = [entry]
+            else:
+                expired = list()
+            expired.extend(self._pop_expired())
+        self._close_entries(expired)
+        return True
+
+    def expire(self, key):
+        """
+        Sets zero time-to-live to the connections for _key_. The idle
+        connections are closed immediately and the leased ones when they
+        are released.
+        """
+        with self._condition:
+            expired = list()
+            for entry in list(self._entries.get(key, [])):
+                entry.ttl = 0
+                if not entry.leases:
+                    self._remove(entry)
+                    expired.append(entry)
+            self._condition.notify_all()
+        self._close_entries(expired)
+
+    def owns(self, connection):
+        return self._find(connection) is not None
+
+    def close(self):
+        """
+        Closes all the connections in the pool.
+        """
+        with self._condition:
+            entries = [e for entries in self._entries.values() for e in entries]
+            self._entries = dict()
+        self._close_entries(entries)
+
+    def _select(self, key, max_leases):
+        available = [e for e in self._entries.get(key, []) if e.leases < max_leases]
+        if not available:
+            return None
+        return max(available, key=lambda e: e.leases)
+
+    def _stop_connecting(self, key):
+        if self._connecting.get(key, 0) > 1:
+            self._connecting[key] -= 1
+        else:
+            self._connecting.pop(key, None)
+
+    def _find(self, connection):
+        with self._condition:
+            for entries in self._entries.values():
+                for entry in entries:
+                    if entry.connection is connection:
+                        return entry
+        return None
+
+    def _discard(self, entry):
+        with self._condition:
+            self._remove(entry)
+            self._condition.notify_all()
+        self._close_entries([entry])
+
+    def _remove(self, entry):
+        entries = self._entries.get(entry.key, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._entries.pop(entry.key, None)
+
+    def _pop_expired(self):
+        now = time.time()
+        expired = list()
+        for key in list(self._entries):
+            for entry in list(self._entries[key]):
+                if entry.is_expired(now):
+                    self._entries[key].remove(entry)
+                    expired.append(entry)
+            if not self._entries[key]:
+                del self._entries[key]
+        return expired
+
+    def _close_entries(self, entries):
+        for entry in entries:
+            try:
+                entry.connection.close_connection()
+            except Exception:  # pylint: disable=broad-except; noqa: W0703
+                debug('Closing pooled connection failed')
+            if entry.parent is not None:
+                self.release(entry.parent)
@@ -1,11 +1,20 @@
 # pylint: disable=redefined-builtin
+import contextlib
+import hashlib
 import os
+import posixpath
 import re
 import sys
+import threading
+from logging import debug
 from crl.remotescript.baseengine import (
     BaseEngine, ExecutionError, SSHException,
     NonZeroExitStatusError, NoExitStatusError)
+from crl.remotescript import connectionmediator
 from crl.remotescript import pathops
+from crl.remotescript import tarstream
+from crl.remotescript.compatibility import shell_quote, to_bytes
+from crl.remotescript.output import FileOutput
 from crl.remotescript.result import Result
 
 
@@ -17,10 +26,184 @@ class FPEngine(BaseEngine):
     SSH_CMD = 'ssh -2 -q -x -e none -oStrictHostKeyChecking=no \
         -oServerAliveInterval=10 -oServerAliveCountMax=3 -oUserKnownHostsFile=/dev/null'
     SCP_CMD = 'scp -2 -q -oStrictHostKeyChecking=no -oUserKnownHostsFile=/dev/null'
+    # Default MaxSessions of OpenSSH server
+    MAX_NODE_CHANNELS = 10
 
     def __init__(self):
         BaseEngine.__init__(self)
         self.default_properties['node_tempdir'] = '/tmp/pdrobot-remotescript/node/' + self._temp_id + '/'
+        self.default_properties['node control master'] = False
+        self.default_properties['node control persist'] = 600
+        self.default_properties['node password'] = None
+        self.default_properties['node port'] = 22
+        self.default_properties['node ssh key file'] = None
+        self.default_properties['node transport'] = 'ssh'
+        self.default_properties['node username'] = None
+        self._control_paths = dict()  # <target, set of control socket paths>
+        self._control_paths_lock = threading.Lock()
+
+    def close(self):
+        """
+        Stops the SSH control masters of the nodes and closes the engine.
+        """
+        self._stop_control_masters()
+        BaseEngine.close(self)
+
+    def _use_direct_node_transport(self, target):
+        transport = self._get_str_target_property(target, 'node transport').lower()
+        if transport not in ['ssh', 'direct']:
+            raise ValueError('Unsupported node transport "' + transport + '"')
+        if transport == 'ssh':
+            return False
+        if self.targets[target].protocol not in ['ssh/sftp', 'ssh']:
+            raise ValueError('Direct node transport requires SSH/SFTP target, not "' +
+                             self.targets[target].protocol + '"')
+        return True
+
+    @contextlib.contextmanager
+    def _node_connection(self, node, target):
+        """
+        Makes SSH connection to _node_ opened over a direct-tcpip channel
+        of the connection to _target_ the current connection. The
+        connection is kept in the connection pool with the target
+        connection if target property _persistent connection_ is True.
+        Resumed transfers reopen the node connection, not the connection
+        to _target_.
+        """
+        target_connection = self._thread_local.connection
+        target_reconnect = self._thread_local.reconnect
+        self._thread_local.connection = self._get_node_connection(node, target)
+        self._thread_local.runner.connections.append(self._thread_local.connection)
+
+        def reconnect(target):
+            self._release_node_connection(self._thread_local.connection)
+            self._thread_local.connection = target_connection
+            if not target_connection.is_alive():
+                return False
+            self._thread_local.connection = self._get_node_connection(node, target)
+            self._thread_local.runner.connections.append(self._thread_local.connection)
+            return True
+
+        self._thread_local.reconnect = reconnect
+        try:
+            yield self._thread_local.connection
+        finally:
+            self._thread_local.reconnect = target_reconnect
+            if self._thread_local.connection is not target_connection:
+                self._release_node_connection(self._thread_local.connection)
+            self._thread_local.connection = target_connection
+
+    def _release_node_connection(self, connection):
+        if not self._connection_pool.release(connection):
+            connection.close_connection()
+
+    def _get_node_connection(self, node, target):
+        """
+        Returns connection to _node_ over the current connection to
+        _target_. The node connections are pooled per target connection
+        and the target connection stays in the pool as long as any node
+        connection opened over it does.
+        """
+        props = self.get_target_properties(target)
+        port = int(props.get('node port'))
+        username, password, sshkeyfile = self._get_node_credentials(target)
+        gateway = self._thread_local.connection
+        if (not self._get_bool_target_property(target, 'persistent connection')
+                or not self._connection_pool.owns(gateway)):
+            return self._open_node_connection(node, port, target, username, password, sshkeyfile)
+        ttl = self._get_int_target_property(target, 'connection idle timeout')
+        key = ('node', id(gateway), node, port, username, password, sshkeyfile)
+        connection = self._connection_pool.acquire(key, ttl)
+        if connection is None:
+            try:
+                connection = self._open_node_connection(node, port, target, username, password, sshkeyfile)
+            except Exception:
+                self._connection_pool.cancel(key)
+                raise
+            self._connection_pool.add(key, connection, ttl, parent=gateway)
+        return connection
+
+    def _get_node_credentials(self, target):
+        """
+        Returns (username, password, sshkeyfile) for logging in to the
+        nodes of _target_. The target properties _node username_, _node
+        password_ and _node ssh key file_ are used if set. Otherwise the
+        su user of the target is the node user as with the ssh node
+        transport, or the user of the target if su user is not set.
+        """
+        props = self.get_target_properties(target)
+        username, password = props.get('su username'), props.get('su password')
+        if not username:
+            username, password = self.targets[target].username, self.targets[target].password
+        if props.get('node username'):
+            username, password = props.get('node username'), None
+        password = props.get('node password') or password
+        sshkeyfile = props.get('node ssh key file') or self.targets[target].sshkeyfile
+        return str(username), password, sshkeyfile
+
+    def _open_node_connection(self, node, port, target, username, password, sshkeyfile):
+        self._debug('Connecting to node "%s:%d" through target "%s"' % (node, port, target))
+        connection = connectionmediator.SSH()
+        connection.set_transport_options(**self._get_transport_options(target))
+        connection.open_tunneled_connection(self._thread_local.connection, node, port,
+                                            self._get_str_target_property(target, 'login timeout'))
+        try:
+            self._login_connection(connection, target, username, password, sshkeyfile)
+        except BaseException:
+            connection.close_connection()
+            raise
+        return connection
+
+    def _get_node_ssh_cmd(self, node, target, exec_id):
+        return FPEngine.SSH_CMD + self._get_control_options(node, target, exec_id)
+
+    def _get_node_scp_cmd(self, node, target, exec_id):
+        return FPEngine.SCP_CMD + self._get_control_options(node, target, exec_id)
+
+    def _get_control_options(self, node, target, exec_id):
+        """
+        Returns ssh options sharing one SSH connection from _target_ to
+        _node_ as the current su user between the node operations if
+        target property _node control master_ is True. The control socket
+        is created in the target on the first use.
+        """
+        if not self._get_bool_target_property(target, 'node control master'):
+            return ''
+        control_dir = self._get_control_dir(target)
+        key = '%s %s %s' % (target, node, self._thread_local.connection.get_su_username())
+        control_path = pathops.join(control_dir, hashlib.sha1(to_bytes(key)).hexdigest()[:16])
+        with self._control_paths_lock:
+            known = target in self._control_paths
+        if not known:
+            result = self._execute_impl('mkdir -p -m 700 ' + control_dir, target, exec_id)
+            if result.status != str(0):
+                raise ExecutionError('Creating control socket dir "%s:%s" failed: %s' % (target, control_dir, result))
+        with self._control_paths_lock:
+            self._control_paths.setdefault(target, set()).add(control_path)
+        return ' -oControlMaster=auto -oControlPath=%s -oControlPersist=%d' % (
+            control_path, int(self._get_int_target_property(target, 'node control persist')))
+
+    def _get_control_dir(self, target):
+        return pathops.join(self._get_str_target_property(target, 'tempdir'), 'ssh-control')
+
+    def _stop_control_masters(self):
+        with self._control_paths_lock:
+            control_paths = self._control_paths
+            self._control_paths = dict()
+        for target in sorted(control_paths):
+            exec_id = 'node-control-master-exit-' + target
+            try:
+                self._start_thread(exec_id, target, self._stop_control_masters_impl,
+                                   [sorted(control_paths[target]), target, exec_id])
+                self._join_thread(exec_id, 60)
+            except Exception:  # pylint: disable=broad-except; noqa: W0703
+                debug('Stopping node control masters of target "%s" failed: %s' % (target, sys.exc_info()[1]))
+
+    def _stop_control_masters_impl(self, control_paths, target, exec_id):
+        return self._execute_impl(
+            'for p in %s; do ssh -O exit -oControlPath=$p node 2>/dev/null; done; rm -rf %s' % (
+                ' '.join(control_paths), self._get_control_dir(target)),
+            target, exec_id)
 
     def node_execute(self, node, command, target, exec_id, timeout):
         self._start_thread(exec_id, target, self._node_execute_impl,
@@ -31,17 +214,31 @@ class FPEngine(BaseEngine):
         self._start_thread(exec_id, target, self._node_execute_impl,
                            [node, command, target, exec_id])
 
+    def node_execute_in_nodes(self, nodes, command, target, exec_id, timeout, max_parallel):
+        self._check_target(target)
+        nodes = self._split_list(nodes)
+        channels = min(max(1, int(max_parallel)), FPEngine.MAX_NODE_CHANNELS)
+        with self._shared_connection(target, channels):
+            return self._run_in_parallel(
+                nodes, exec_id, timeout, max_parallel,
+                lambda node, node_exec_id: self._start_thread(
+                    node_exec_id, target, self._node_execute_impl, [node, command, target, node_exec_id]))
+
     def _node_execute_impl(self, node, command, target, exec_id):
-        command = self._wrap_node_command(command, node)
+        if self._use_direct_node_transport(target):
+            with self._node_connection(node, target):
+                return self._execute_impl(command, target, exec_id)
+        command = self._wrap_node_command(command, node, target, exec_id)
         return self._execute_impl(command, target, exec_id)
 
-    def _wrap_node_command(self, command, node):
+    def _wrap_node_command(self, command, node, target, exec_id):
         if re.search("'", command):
             raise ExecutionError(
                 'Command in Node keyword may not contain single quotes. \
                         Consider using double quotes or Node Script keyword: "' + command + '"')
         sunode = self._add_su_user(node)
-        return FPEngine.SSH_CMD + " " + sunode + " '" + BaseEngine.CONNECTION_MONITOR_CMD + '; ' + command + "'"
+        return (self._get_node_ssh_cmd(node, target, exec_id) + " " + sunode + " '" +
+                BaseEngine.CONNECTION_MONITOR_CMD + '; ' + command + "'")
 
     def _add_su_user(self, node):
         su_username = self._thread_local.connection.get_su_username()
@@ -61,6 +258,15 @@ class FPEngine(BaseEngine):
     def _node_script_impl(self, node, file, target, exec_id):
         if not os.path.exists(file):
             raise IOError('File not found ' + file + ' (Working  directory: ' + os.getcwd() + ')')
+        if self._use_direct_node_transport(target):
+            with self._node_connection(node, target):
+                return self._execute_script_impl(file, target, exec_id)
+        if self._use_script_stdin(target):
+            # ssh in the target passes the standard input to the node
+            self._debug('Streaming ' + file + ' to node ' + node + ' through target ' + target)
+            return self._execute_impl(
+                self._wrap_node_command(self._get_stdin_interpreter(file), node, target, exec_id),
+                target, exec_id, stdin=lambda f: self._copy_file_to(file, f))
         filename = os.path.basename(file)
         target_temp_dir = pathops.append(
             self._get_str_target_property(target, 'tempdir'), '-' + exec_id)
@@ -71,15 +277,16 @@ class FPEngine(BaseEngine):
         self._mkdir_impl(target_temp_dir, oct(0o777), target, exec_id)
         self._put_file_impl(file, target_temp_dir, oct(0o777), target, exec_id)
         sunode = self._add_su_user(node)
-        command = FPEngine.SSH_CMD + ' ' + sunode + ' \'cd ' + node_temp_dir + '; chmod +x ' + node_temp_file + '; '
+        ssh_cmd = self._get_node_ssh_cmd(node, target, exec_id)
+        command = ssh_cmd + ' ' + sunode + ' \'cd ' + node_temp_dir + '; chmod +x ' + node_temp_file + '; '
         command += BaseEngine.CONNECTION_MONITOR_CMD + '; ' + node_temp_file + "'"
         result = self._execute_impl(
-            FPEngine.SSH_CMD + ' ' + sunode + ' "umask 0000; mkdir -p ' + node_temp_dir + '"', target, exec_id)
+            ssh_cmd + ' ' + sunode + ' "umask 0000; mkdir -p ' + node_temp_dir + '"', target, exec_id)
         if result.status != str(0):
             raise ExecutionError(
                 'Creating temp dir "%s:%s" failed: %s' % (sunode, node_temp_dir, result))
         result = self._execute_impl(
-            FPEngine.SCP_CMD + ' ' + target_temp_file + ' ' +
+            self._get_node_scp_cmd(node, target, exec_id) + ' ' + target_temp_file + ' ' +
             sunode + ':' + node_temp_file, target, exec_id)
         if result.status != str(0):
             raise ExecutionError('Copying script to "%s:%s" failed: %s' % (sunode, node_temp_file, result))
@@ -87,7 +294,7 @@ class FPEngine(BaseEngine):
         if self._get_bool_target_property(target, 'cleanup'):
             try:
                 self._execute_impl('rm -rf ' + target_temp_dir + '; ' +
-                                   FPEngine.SSH_CMD + ' ' + sunode + ' rm -rf ' + node_temp_dir,
+                                   ssh_cmd + ' ' + sunode + ' rm -rf ' + node_temp_dir,
                                    target, exec_id)
             except (SSHException, NoExitStatusError, NonZeroExitStatusError):
                 self._debug('Target "' + str(target) + ":" + node +
@@ -102,6 +309,11 @@ class FPEngine(BaseEngine):
     def _node_put_file_impl(self, node, source_file, destination_dir, mode, target, exec_id):
         if not os.path.exists(source_file):
             raise IOError(''.join(['File not found: "', source_file, '" (cwd: ', os.getcwd(), ')']))
+        if self._use_direct_node_transport(target):
+            with self._node_connection(node, target):
+                return self._put_file_impl(source_file, destination_dir, mode, target, exec_id)
+        if self._thread_local.connection.supports_stdin():
+            return self._node_put_file_streamed_impl(node, source_file, destination_dir, mode, target, exec_id)
         filename = os.path.basename(source_file)
         target_temp_dir = pathops.append(self._get_str_target_property(target, 'tempdir'), '-' + exec_id)
         target_temp_file = pathops.join(target_temp_dir, filename)
@@ -111,16 +323,18 @@ class FPEngine(BaseEngine):
         self._mkdir_impl(target_temp_dir, oct(0o777), target, exec_id)
         self._put_file_impl(source_file, target_temp_dir, oct(0o777), target, exec_id)
         sunode = self._add_su_user(node)
+        ssh_cmd = self._get_node_ssh_cmd(node, target, exec_id)
         result = self._execute_impl(
-            FPEngine.SSH_CMD + ' ' + sunode + ' "umask 0000; mkdir -p ' + destination_dir + '"', target, exec_id)
+            ssh_cmd + ' ' + sunode + ' "umask 0000; mkdir -p ' + destination_dir + '"', target, exec_id)
         if result.status != str(0):
             raise ExecutionError('Creating destination dir "%s:%s" failed: %s' % (sunode, destination_dir, result))
         result = self._execute_impl(
-            FPEngine.SCP_CMD + ' ' + target_temp_file + ' ' + sunode + ':' + destination_file, target, exec_id)
+            self._get_node_scp_cmd(node, target, exec_id) + ' ' + target_temp_file + ' ' +
+            sunode + ':' + destination_file, target, exec_id)
         if result.status != str(0):
             raise ExecutionError('Copying file to "%s:%s" failed: %s' % (sunode, destination_file, result))
         result = self._execute_impl(
-            FPEngine.SSH_CMD + ' ' + sunode + ' chmod ' + mode + ' ' + destination_file, target, exec_id)
+            ssh_cmd + ' ' + sunode + ' chmod ' + mode + ' ' + destination_file, target, exec_id)
         if result.status != str(0):
             raise ExecutionError('Setting mode %s on file "%s:%s" failed: %s' %
                                  (mode, sunode, destination_file, result))
@@ -128,18 +342,41 @@ class FPEngine(BaseEngine):
             self._execute_impl('rm -rf ' + target_temp_dir, target, exec_id)
         return Result.SUCCESS
 
+    def _node_put_file_streamed_impl(self, node, source_file, destination_dir, mode, target, exec_id):
+        """
+        Copies _source_file_ to the node by streaming it to the standard
+        input of cat executed in the node over one command in the target.
+        """
+        sunode = self._add_su_user(node)
+        destination_file = pathops.join(destination_dir, os.path.basename(source_file))
+        self._debug(''.join(['Streaming localhost:', source_file, ' -> ', target, ':', node, ':', destination_file]))
+        command = '(umask 0000 && mkdir -p %s) && cat > %s && chmod %o %s' % (
+            shell_quote(destination_dir), shell_quote(destination_file), int(mode, 8), shell_quote(destination_file))
+        result = self._execute_impl(
+            self._get_node_ssh_cmd(node, target, exec_id) + ' ' + sunode + ' ' + shell_quote(command),
+            target, exec_id, stdin=lambda f: self._copy_file_to(source_file, f))
+        if result.status != str(0):
+            raise ExecutionError('Copying file to "%s:%s" failed: %s' % (sunode, destination_file, result))
+        return Result.SUCCESS
+
     def node_get_file(self, node, source_file, destination, target, exec_id, timeout):
         self._start_thread(exec_id, target, self._node_get_file_impl, [node, source_file, destination, target, exec_id])
         return self._join_thread(exec_id, timeout)
 
     def _node_get_file_impl(self, node, source_file, destination, target, exec_id):
+        if self._use_direct_node_transport(target):
+            with self._node_connection(node, target):
+                return self._get_file_impl(source_file, destination, target, exec_id)
+        if self._thread_local.connection.supports_stdin():
+            return self._node_get_file_streamed_impl(node, source_file, destination, target, exec_id)
         filename = os.path.basename(source_file)
         target_temp_dir = pathops.append(self._get_str_target_property(target, 'tempdir'), '-' + exec_id)
         target_temp_file = pathops.join(target_temp_dir, filename)
         self._debug(''.join(['Copying ', target, ':', node, ':', source_file,
                              ' -> ', target, ':', target_temp_file, ' -> localhost:', destination]))
         sunode = self._add_su_user(node)
-        result = self._execute_impl(''.join(['umask 0000; mkdir -p ', target_temp_dir, '; ', FPEngine.SCP_CMD, ' ',
+        result = self._execute_impl(''.join(['umask 0000; mkdir -p ', target_temp_dir, '; ',
+                                             self._get_node_scp_cmd(node, target, exec_id), ' ',
                                              sunode, ':', source_file, ' ', target_temp_file]), target, exec_id)
         if result.status != str(0):
             raise ExecutionError('Copying file from "%s:%s" node failed: %s' % (sunode, source_file, result))
@@ -147,3 +384,109 @@ class FPEngine(BaseEngine):
         if self._get_bool_target_property(target, 'cleanup'):
             self._execute_impl('rm -rf ' + target_temp_dir, target, exec_id)
         return Result.SUCCESS
+
+    def _node_get_file_streamed_impl(self, node, source_file, destination, target, exec_id):
+        """
+        Copies _source_file_ from the node by writing the standard output
+        of cat executed in the node over one command in the target to
+        _destination_. The size of the copy is checked against the size
+        of _source_file_ which stat writes to the standard error.
+        """
+        sunode = self._add_su_user(node)
+        destination = os.path.abspath(destination.replace('/', os.sep))
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, posixpath.basename(source_file))
+        elif not os.path.exists(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        self._debug(''.join(['Streaming ', target, ':', node, ':', source_file, ' -> localhost:', destination]))
+        output = FileOutput(destination)
+        try:
+            result = self._execute_impl(
+                self._get_node_ssh_cmd(node, target, exec_id) + ' ' + sunode + ' ' +
+                shell_quote('cat %s && stat -c %%s %s >&2' % (shell_quote(source_file), shell_quote(source_file))),
+                target, exec_id, output=output, stdin=lambda f: None)
+            if result.status != str(0):
+                raise ExecutionError('Copying file from "%s:%s" node failed: %s' % (sunode, source_file, result))
+            size = result.stderr.split()[-1] if result.stderr.split() else ''
+            if size != str(output.size):
+                raise ExecutionError('Copying file from "%s:%s" node failed: copied %d bytes, source size is "%s"' %
+                                     (sunode, source_file, output.size, size))
+        except BaseException:
+            output.close()
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
+        return Result.SUCCESS
+
+    def node_put_dir(self, node, source_dir, destination_dir, mode, compression, target, exec_id, timeout):
+        self._start_thread(exec_id, target, self._node_put_dir_impl,
+                           [node, source_dir, destination_dir, mode, compression, target, exec_id])
+        return self._join_thread(exec_id, timeout)
+
+    def _node_put_dir_impl(self, node, source_dir, destination_dir, mode, compression, target, exec_id):
+        level = self._get_node_compression_level(compression, target)
+        mode = int(mode, 8)
+        self._debug(''.join(
+            ['Streaming directory "', source_dir, '" to node "', target, ':', node,
+             ':', destination_dir, '" (cwd: ', os.getcwd(), ')']))
+        result = self._execute_streamed_in_node(
+            node, 'umask 0000; mkdir -p -m %o %s && tar -x%sf - -C %s' % (
+                mode, shell_quote(destination_dir), 'z' if level else '', shell_quote(destination_dir)),
+            target, exec_id,
+            stdin=lambda f: tarstream.write_tree(f, source_dir, mode, bool(level), compress_level=level or 9))
+        if result.status != str(0):
+            raise ExecutionError('Extracting directory to "%s:%s" failed: %s' % (node, destination_dir, result))
+        return Result.SUCCESS
+
+    def node_get_dir(self, node, source_dir, destination_dir, include, exclude, compression, target, exec_id,
+                     timeout):
+        self._start_thread(exec_id, target, self._node_get_dir_impl,
+                           [node, source_dir, destination_dir, include, exclude, compression, target, exec_id])
+        return self._join_thread(exec_id, timeout)
+
+    def _node_get_dir_impl(self, node, source_dir, destination_dir, include, exclude, compression, target,
+                           exec_id):
+        level = self._get_node_compression_level(compression, target)
+        self._debug(''.join(
+            ['Streaming directory from node "', target, ':', node, ':', source_dir, '" to "',
+             destination_dir, '" (cwd: ', os.getcwd(), ')']))
+        command = 'set -o pipefail; cd %s && %s | tar -cf - --no-recursion -T -' % (
+            shell_quote(source_dir), self._get_find_command(include, exclude))
+        if level:
+            command += ' | gzip -%d' % level
+        output = tarstream.ExtractingOutput(destination_dir)
+        result = self._execute_streamed_in_node(node, command, target, exec_id, output=output, stdin=lambda f: None)
+        if result.status != str(0):
+            raise ExecutionError('Archiving directory "%s:%s" failed: %s' % (node, source_dir, result))
+        if output.error is not None:
+            raise ExecutionError('Extracting directory from "%s:%s" failed: %s' % (node, source_dir, output.error))
+        return Result.SUCCESS
+
+    def _get_node_compression_level(self, compression, target):
+        """
+        Returns gzip compression level of node directory transfers, 0
+        for no compression. By default the archive is compressed with
+        level 6 if target property _directory transfer_ is "tar.gz".
+        """
+        if compression is None or compression == '':
+            transfer = self._get_str_target_property(target, 'directory transfer').lower()
+            return 6 if transfer == 'tar.gz' else 0
+        level = int(compression)
+        if not 0 <= level <= 9:
+            raise ValueError('Unsupported compression level "%s"' % compression)
+        return level
+
+    def _execute_streamed_in_node(self, node, command, target, exec_id, output=None, stdin=None):
+        """
+        Executes _command_ in _node_ passing binary standard input and
+        output through the target, or over the direct node connection
+        with target property _node transport_ "direct".
+        """
+        if self._use_direct_node_transport(target):
+            with self._node_connection(node, target):
+                return self._execute_impl(command, target, exec_id, output=output, stdin=stdin)
+        if not self._thread_local.connection.supports_stdin():
+            raise ExecutionError('Streaming to node "%s" requires SSH connection to target "%s"' % (node, target))
+        return self._execute_impl(
+            self._get_node_ssh_cmd(node, target, exec_id) + ' ' + self._add_su_user(node) + ' ' + shell_quote(command),
+            target, exec_id, output=output, stdin=stdin)
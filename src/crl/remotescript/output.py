@@ -0,0 +1,391 @@
+import codecs
+import collections
+import os
+import tempfile
+import threading
+import weakref
+from crl.remotescript.compatibility import PY3, to_bytes
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+
+class OutputCollector(object):
+    """
+    Collects remote command output in memory.
+    """
+
+    def __init__(self):
+        self._chunks = {STDOUT: list(), STDERR: list()}
+        self.truncated = {STDOUT: 0, STDERR: 0}
+
+    def write(self, stream, data):
+        self._chunks[stream].append(to_bytes(data))
+
+    def close(self):
+        pass
+
+    @property
+    def stdout(self):
+        return b''.join(self._chunks[STDOUT])
+
+    @property
+    def stderr(self):
+        return b''.join(self._chunks[STDERR])
+
+
+class _HeadTailBuffer(object):
+
+    def __init__(self, max_size):
+        self._head_size = max_size // 2
+        self._tail_size = max_size - self._head_size
+        self._head = list()
+        self._head_len = 0
+        self._tail = collections.deque()
+        self._tail_len = 0
+        self.truncated = 0
+
+    def write(self, data):
+        if self._head_len < self._head_size:
+            head = data[:self._head_size - self._head_len]
+            self._head.append(head)
+            self._head_len += len(head)
+            data = data[len(head):]
+        if not data:
+            return
+        self._tail.append(data)
+        self._tail_len += len(data)
+        while self._tail_len > self._tail_size:
+            excess = self._tail_len - self._tail_size
+            first = self._tail[0]
+            if len(first) <= excess:
+                self._tail.popleft()
+                dropped = len(first)
+            else:
+                self._tail[0] = first[excess:]
+                dropped = excess
+            self._tail_len -= dropped
+            self.truncated += dropped
+
+    def getvalue(self):
+        return b''.join(self._head) + b''.join(self._tail)
+
+
+class BoundedOutputCollector(OutputCollector):
+    """
+    Collects at most _max_size_ bytes of each output stream in memory.
+
+    If the output exceeds _max_size_, the first and the last half of
+    _max_size_ bytes are kept and the number of discarded bytes is
+    recorded to _truncated_.
+    """
+
+    def __init__(self, max_size):
+        super(BoundedOutputCollector, self).__init__()
+        self._buffers = {STDOUT: _HeadTailBuffer(max_size), STDERR: _HeadTailBuffer(max_size)}
+
+    def write(self, stream, data):
+        self._buffers[stream].write(to_bytes(data))
+        self.truncated[stream] = self._buffers[stream].truncated
+
+    @property
+    def stdout(self):
+        return self._buffers[STDOUT].getvalue()
+
+    @property
+    def stderr(self):
+        return self._buffers[STDERR].getvalue()
+
+
+class FileOutput(object):
+    """
+    Output sink writing standard output of a remote command to local
+    file _path_. Standard error is collected up to _max_stderr_ bytes.
+    The number of bytes written is in _size_.
+    """
+
+    def __init__(self, path, max_stderr=65536):
+        self.size = 0
+        self._file = open(path, 'wb')
+        self._stderr = BoundedOutputCollector(max_stderr)
+
+    def write(self, stream, data):
+        if stream == STDOUT:
+            data = to_bytes(data)
+            self._file.write(data)
+            self.size += len(data)
+        else:
+            self._stderr.write(stream, data)
+
+    def close(self):
+        self._file.close()
+
+    stdout = b''
+
+    @property
+    def stderr(self):
+        return self._stderr.stderr
+
+    @property
+    def truncated(self):
+        return self._stderr.truncated
+
+
+class SpilledOutput(object):
+    """
+    Remote command output stored in local file _path_.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class _SpillBuffer(object):
+
+    def __init__(self, max_size, directory, prefix):
+        self._max_size = max_size
+        self._directory = directory
+        self._prefix = prefix
+        self._chunks = list()
+        self._size = 0
+        self._path = None
+        self._file = None
+
+    def write(self, data):
+        self._size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if self._size > self._max_size:
+            fd, self._path = tempfile.mkstemp(prefix=self._prefix, dir=self._directory)
+            self._file = os.fdopen(fd, 'wb')
+            for chunk in self._chunks:
+                self._file.write(chunk)
+            self._chunks = list()
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+    def getvalue(self):
+        if self._file is None:
+            return b''.join(self._chunks)
+        return SpilledOutput(self._path, self._size)
+
+
+class SpillingOutputCollector(OutputCollector):
+    """
+    Collects at most _max_size_ bytes of each output stream in memory.
+
+    If the output exceeds _max_size_, the whole output of the stream is
+    written to a temporary file in _directory_ and the stream value is
+    `SpilledOutput` instead of bytes.
+    """
+
+    def __init__(self, max_size, directory):
+        super(SpillingOutputCollector, self).__init__()
+        self._buffers = {STDOUT: _SpillBuffer(max_size, directory, 'stdout-'),
+                         STDERR: _SpillBuffer(max_size, directory, 'stderr-')}
+
+    def write(self, stream, data):
+        self._buffers[stream].write(to_bytes(data))
+
+    def close(self):
+        for buf in self._buffers.values():
+            buf.close()
+
+    @property
+    def stdout(self):
+        return self._buffers[STDOUT].getvalue()
+
+    @property
+    def stderr(self):
+        return self._buffers[STDERR].getvalue()
+
+
+class StreamingOutput(object):
+    """
+    Passes remote command output to _callback_ as it arrives.
+
+    _callback_ is called with the stream name (\"stdout\" or
+    \"stderr\") and the decoded output. If _lines_ is True, output is
+    passed line by line without the line terminator, otherwise output
+    is passed in chunks as received. The output is not stored.
+    """
+
+    def __init__(self, callback, lines=False):
+        self._callback = callback
+        self._lines = lines
+        self._decoders = {STDOUT: self._create_decoder(), STDERR: self._create_decoder()}
+        self._partial = {STDOUT: u'', STDERR: u''}
+
+    @staticmethod
+    def _create_decoder():
+        return codecs.getincrementaldecoder('utf-8')('compatibilityreplace')
+
+    def write(self, stream, data):
+        self._deliver(stream, self._decoders[stream].decode(to_bytes(data)))
+
+    def close(self):
+        for stream in (STDOUT, STDERR):
+            self._deliver(stream, self._decoders[stream].decode(b'', True))
+            if self._partial[stream]:
+                self._call(stream, self._partial[stream])
+                self._partial[stream] = u''
+
+    def _deliver(self, stream, text):
+        if not text:
+            return
+        if not self._lines:
+            self._call(stream, text)
+            return
+        lines = (self._partial[stream] + text).split(u'\n')
+        self._partial[stream] = lines.pop()
+        for line in lines:
+            self._call(stream, line.rstrip(u'\r'))
+
+    def _call(self, stream, text):
+        self._callback(stream, text if PY3 else text.encode('utf-8'))
+
+    stdout = b''
+    stderr = b''
+    truncated = {STDOUT: 0, STDERR: 0}
+
+
+class OutputStreamClosedError(Exception):
+    pass
+
+
+class _StreamState(object):
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.closed = threading.Event()
+        self.finished = threading.Event()
+        self.ref = None
+
+
+class OutputStream(object):
+    """
+    Iterator over remote command output.
+
+    Iterating yields (stream, output) tuples as described in
+    `StreamingOutput` until the command has finished. After the
+    iteration the [crl.remotescript.result.Result.html|Result] of the
+    command is available in _result_. Exceptions raised by the execution
+    are raised from the iteration.
+
+    At most _max_queued_ outputs are buffered, so a slow consumer
+    throttles the command instead of the output piling up in memory.
+    `close` stops the iteration and the command. The command is stopped
+    in the same way if the iterator is garbage collected before the
+    command has finished.
+    """
+
+    _END = object()
+
+    def __init__(self, execute, lines=False, interrupt=None, max_queued=1000):
+        """
+        _execute_ is called in a separate thread with `StreamingOutput`
+        as the only argument and it must return the final result.
+        _interrupt_ is called without arguments to stop the execution
+        when the iteration is abandoned.
+        """
+        # The thread refers only to the queue and the state so that
+        # abandoned iterators can be garbage collected.
+        self._queue = chunks = queue.Queue(max(int(max_queued), 2))
+        self._state = state = _StreamState()
+        output = StreamingOutput(lambda stream, text: OutputStream._put(chunks, state, (stream, text)), lines)
+        self._thread = threading.Thread(target=OutputStream._run, args=(execute, output, chunks, state))
+        self._thread.daemon = True
+        state.ref = weakref.ref(self, lambda _: OutputStream._abandon(chunks, state, interrupt))
+        self._interrupt = interrupt
+        self._thread.start()
+
+    @property
+    def result(self):
+        return self._state.result
+
+    @staticmethod
+    def _run(execute, output, chunks, state):
+        try:
+            state.result = execute(output)
+        except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+            state.error = e
+        finally:
+            state.finished.set()
+            chunks.put(OutputStream._END)
+
+    @staticmethod
+    def _put(chunks, state, item):
+        if state.closed.is_set():
+            raise OutputStreamClosedError('Output stream closed')
+        chunks.put(item)
+
+    @staticmethod
+    def _abandon(chunks, state, interrupt):
+        state.closed.set()
+        # The execution ID may already be used by another execution
+        if interrupt is not None and not state.finished.is_set():
+            interrupt()
+        OutputStream._drain(chunks)
+
+    @staticmethod
+    def _drain(chunks):
+        try:
+            while True:
+                chunks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def close(self):
+        """
+        Stops the iteration and the command. Output not read yet is
+        discarded.
+        """
+        if not self._thread.is_alive():
+            return
+        OutputStream._abandon(self._queue, self._state, self._interrupt)
+        while self._thread.is_alive():
+            self._thread.join(0.1)
+            OutputStream._drain(self._queue)
+        self._state.error = None
+        self._queue.put(OutputStream._END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if item is OutputStream._END:
+            self._queue.put(OutputStream._END)
+            self._thread.join()
+            if self._state.error is not None:
+                error, self._state.error = self._state.error, None
+                raise error
+            raise StopIteration
+        return item
+
+    next = __next__  # Python 2
@@ -7,6 +7,10 @@ class RemoteFile(object):
     def write(data):
         raise NotImplementedError()
 
+    @staticmethod
+    def set_pipelined(pipelined):
+        pass
+
     @staticmethod
     def chmod(mode):
         raise NotImplementedError()
@@ -1,4 +1,5 @@
 from crl.remotescript import pathops
+from crl.remotescript.output import SpilledOutput
 from crl.remotescript.compatibility import (
     unic_to_string, py23_unic)
 
@@ -31,24 +32,52 @@ class Result(object):
     CLOSE_FAIL = OPEN_FAIL
     UNKNOWN_STATUS = 'unknown'
 
-    def __init__(self, status, stdout, stderr, connection_ok, close_ok):
+    def __init__(self, status, stdout, stderr, connection_ok, close_ok,
+                 stdout_truncated=0, stderr_truncated=0):
         """
         *Arguments:*\n
         _status_: Exit status of the remote command.\n
-        _stdout_: Standard output of the remote command.\n
-        _stderr_: Standard error of the remote command.\n
+        _stdout_: Standard output of the remote command. If the output has been
+                     stored to a local file, the file is read when _stdout_ is
+                     accessed and the file path is available in _stdout_file_.\n
+        _stderr_: Standard error of the remote command. See _stdout_.\n
         _connection_ok_: \"True\" if connection was opened succesfully. \"False\"
                      if opening connection failed. See also 'connection failure is error' property\n
         _close_ok_:   Tells how the connection was closed: \"True\" if the command was executed
                      normally, \"False\" if executing command ended prematurely.
                      See also 'connection break is error' property\n
+        _stdout_truncated_: Number of bytes discarded from the middle of stdout.
+                     See also 'max output size' property\n
+        _stderr_truncated_: Number of bytes discarded from the middle of stderr.\n
         """
         self.status = status
-        self.stdout = unic_to_string(py23_unic(stdout))
-        self.stderr = unic_to_string(py23_unic(stderr))
+        self._stdout, self.stdout_file = self._init_output(stdout)
+        self._stderr, self.stderr_file = self._init_output(stderr)
+        self.stdout_truncated = stdout_truncated
+        self.stderr_truncated = stderr_truncated
         self.connection_ok = connection_ok
         self._close_ok = close_ok
 
+    @staticmethod
+    def _init_output(output):
+        if isinstance(output, SpilledOutput):
+            return None, output.path
+        return unic_to_string(py23_unic(output)), None
+
+    @property
+    def stdout(self):
+        return self._read_output(self._stdout, self.stdout_file)
+
+    @property
+    def stderr(self):
+        return self._read_output(self._stderr, self.stderr_file)
+
+    @staticmethod
+    def _read_output(output, path):
+        if path is None:
+            return output
+        return unic_to_string(py23_unic(SpilledOutput(path, None).read().strip()))
+
     def __str__(self):
         return ' '.join(['\n',
                          'connection OK: ', self.connection_ok, '\n',
@@ -60,3 +89,110 @@ class Result(object):
 
 Result.SUCCESS = Result('0', '', '', Result.OPEN_OK, Result.CLOSE_OK)
 Result.CONNECTION_FAILURE = Result(Result.UNKNOWN_STATUS, '', '', Result.OPEN_FAIL, Result.CLOSE_FAIL)
+
+
+class MultiResult(dict):
+    """
+    Results of an operation executed in several targets in
+    [crl.remotescript.remotescript.RemoteScript.html|RemoteScript] library.
+    MultiResult maps target name to
+    [crl.remotescript.result.Result.html|Result] of the target.
+
+    If the operation failed in a target with an exception, the result
+    of the target has status \"unknown\" and the exception message is in
+    _errors_. Execution time of each target in seconds is in _timings_ and
+    the total execution time in _elapsed_.
+
+    *Examples:*\n
+    | testcase | ${results}=           | Execute Command In Targets | uname -r          | ${targets} |
+    |          | Should Be Empty       | ${results.failed}          |                   |            |
+    |          | Should Be Equal       | ${results['target_1'].status} | 0              |            |
+    """
+
+    def __init__(self):
+        super(MultiResult, self).__init__()
+        self.errors = dict()
+        self.timings = dict()
+        self.elapsed = 0.0
+
+    @property
+    def failed(self):
+        """
+        Names of the targets in which the operation raised exception or
+        returned non-zero exit status.
+        """
+        return sorted(name for name, result in self.items()
+                      if name in self.errors or result.status != '0')
+
+    def __str__(self):
+        lines = list()
+        for name in sorted(self):
+            lines.append('\n%s (%.3f s):' % (name, self.timings.get(name, 0.0)))
+            if name in self.errors:
+                lines.append('\n error: ' + self.errors[name])
+            lines.append(str(self[name]))
+        return ''.join(lines)
+
+
+class SyncResult(Result):
+    """
+    Result of directory synchronization in
+    [crl.remotescript.remotescript.RemoteScript.html|RemoteScript] library.
+
+    Paths relative to the synchronized directory of the files copied to
+    the target are in _sent_, of the unchanged files in _skipped_ and of
+    the extraneous files and directories removed from the target in
+    _deleted_. The number of bytes copied is in _bytes_sent_ and the size
+    of the skipped files in _bytes_saved_. _stdout_ contains a summary.
+
+    *Examples:*\n
+    | testcase | ${result}=      | Sync Directory To Target | tools            | /opt/tools |
+    |          | Should Be Empty | ${result.sent}           |                  |            |
+    |          | Log             | ${result.bytes_saved}    |                  |            |
+    """
+
+    def __init__(self, sent, skipped, deleted, bytes_sent, bytes_saved):
+        self.sent = sent
+        self.skipped = skipped
+        self.deleted = deleted
+        self.bytes_sent = bytes_sent
+        self.bytes_saved = bytes_saved
+        super(SyncResult, self).__init__(
+            '0', 'sent %d files (%d bytes), skipped %d files (%d bytes saved), deleted %d paths' % (
+                len(sent), bytes_sent, len(skipped), bytes_saved, len(deleted)),
+            '', Result.OPEN_OK, Result.CLOSE_OK)
+
+
+class BenchmarkResult(Result):
+    """
+    Result of connection benchmark in
+    [crl.remotescript.remotescript.RemoteScript.html|RemoteScript] library.
+
+    _runs_ contains a dictionary for each measured set of target
+    properties in the order of measurement. Key _settings_ holds the
+    properties changed for the run, _connect_ the time in seconds to
+    open and close the connection, _latency_ the median time in seconds
+    to execute an empty command and _upload_ and _download_ the time in
+    seconds to copy the test file to and from the target. The transfer
+    rates in bytes per second are in _upload_rate_ and _download_rate_.
+    _stdout_ contains the runs as a table.
+
+    *Examples:*\n
+    | testcase | ${result}= | Benchmark Target Connection | size=${10485760}      |
+    |          | Log        | ${result.stdout}            |                       |
+    |          | Log        | ${result.runs[0]['upload_rate']} |                  |
+    """
+
+    def __init__(self, size, runs):
+        self.size = size
+        self.runs = runs
+        for run in runs:
+            for direction in ['upload', 'download']:
+                run[direction + '_rate'] = size / max(run[direction], 1e-9)
+        lines = ['%-10s %-10s %-14s %-16s %s' % (
+            'connect s', 'latency s', 'upload MB/s', 'download MB/s', 'settings')]
+        for run in runs:
+            lines.append('%-10.3f %-10.4f %-14.2f %-16.2f %s' % (
+                run['connect'], run['latency'], run['upload_rate'] / 1e6, run['download_rate'] / 1e6,
+                ', '.join('%s=%s' % item for item in sorted(run['settings'].items())) or 'current'))
+        super(BenchmarkResult, self).__init__('0', '\n'.join(lines), '', Result.OPEN_OK, Result.CLOSE_OK)
@@ -1,12 +1,20 @@
 # pylint: disable=too-many-branches,too-many-statements
 # pylint: disable=anomalous-backslash-in-string
+import contextlib
+import errno
+import hashlib
 import os
 import posixpath
 import re
+import socket
 import sys
+import threading
 import time
 from logging import debug
+from stat import S_ISDIR
 import paramiko
+from .compatibility import shell_quote, to_string
+from .output import OutputCollector, STDOUT, STDERR
 from .scp import SCPClient
 from .remotefile import RemoteFile
 from .result import Result
@@ -14,27 +22,94 @@ from .SSHClientBase import (
     SSHClientBase,
     SSHException)
 
+try:
+    import queue
+    from io import StringIO
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+    from StringIO import StringIO  # pylint: disable=import-error
+
 
 __copyright__ = 'Copyright (C) 2019, Nokia'
 
 
 class SSHClient(SSHClientBase):
 
+    KEEPALIVE_INTERVAL = 1.0
+    SU_PASSWORD_TIMEOUT = 10.0
+    COPY_WINDOW = 4 * 1024 * 1024
+    MAX_IDLE_SFTP_SESSIONS = 1
+    STDIN_SUPPORTED = True
+
     def __init__(self):
         super(SSHClient, self).__init__()
         self.host = None
         self.port = None
         self.timeout = None
         self.use_sudo_user = False
+        self._sock = None
+        self._channels = dict()  # <owner thread, set of open channels>
+        self._channels_lock = threading.Lock()
+        self._idle_sftp = list()  # SFTP sessions kept open for reuse
+        self._compress = False
+        self._preferred_algorithms = dict()  # <security option name, preferred algorithms>
+        self._transport_kwargs = dict()
 
-    def open_connection(self, host, port, timeout):
+    def open_connection(self, host, port, timeout, sock=None):
+        """
+        Prepares connection to _host_. If _sock_ is given, the connection
+        is opened over it instead of a new TCP connection.
+        """
         self.host, self.port, self.timeout = host, int(port), float(timeout)
+        self._sock = sock
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
+    def open_tunnel(self, host, port):
+        """
+        Opens direct-tcpip channel to _host_:_port_ forwarded by the
+        remote host for a connection nested in this connection.
+        """
+        return self.client.get_transport().open_channel(
+            'direct-tcpip', (host, int(port)), ('127.0.0.1', 0), timeout=self.timeout)
+
+    def set_transport_options(self, compress=False, ciphers=None, macs=None, kex=None,
+                              window_size=None, max_packet_size=None):
+        """
+        Sets SSH transport options for `login`. Algorithms in lists
+        _ciphers_, _macs_ and _kex_ are offered in the given order before
+        the other algorithms supported by paramiko. _window_size_ and
+        _max_packet_size_ are the defaults of the channels of the
+        connection. All the options but _compress_ require paramiko 3.2
+        or newer.
+        """
+        self._compress = compress
+        self._preferred_algorithms = dict(
+            (name, tuple(algorithms)) for name, algorithms in
+            [('ciphers', ciphers), ('digests', macs), ('kex', kex)] if algorithms)
+        self._transport_kwargs = dict(
+            (name, int(value)) for name, value in
+            [('default_window_size', window_size), ('default_max_packet_size', max_packet_size)] if value)
+        if (self._preferred_algorithms or self._transport_kwargs) and not _supports_transport_factory():
+            raise NotImplementedError('SSH ciphers, MACs, key exchange algorithms, window size and max packet '
+                                      'size require paramiko 3.2 or newer, not %s' % paramiko.__version__)
+
     def login(self, username, password=None, key_filename=None):
+        kwargs = dict()
+        if self._preferred_algorithms or self._transport_kwargs:
+            kwargs['transport_factory'] = self._create_transport
         self.client.connect(self.host, self.port, username, password=password, key_filename=key_filename,
-                            timeout=self.timeout, allow_agent=False)
+                            timeout=self.timeout, allow_agent=False, compress=self._compress, sock=self._sock,
+                            **kwargs)
+
+    def _create_transport(self, sock, **kwargs):
+        kwargs.update(self._transport_kwargs)
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        for name, preferred in self._preferred_algorithms.items():
+            supported = getattr(options, name)
+            setattr(options, name, preferred + tuple(a for a in supported if a not in preferred))
+        return transport
 
     def set_use_sudo_user(self):
         self.use_sudo_user = True
@@ -46,20 +121,117 @@ class SSHClient(SSHClientBase):
                 "su - {su_username} -c '{command}'")
 
     def close_connection(self):
+        with self._channels_lock:
+            self._idle_sftp = list()
         self.client.close()
 
+    def close_channels(self, owner):
+        with self._channels_lock:
+            channels = self._channels.pop(owner, set())
+        for chan in channels:
+            try:
+                chan.close()
+            except (EOFError, socket.error, paramiko.SSHException):
+                # The owner may release and close the connection as soon
+                # as its channel starts closing
+                pass
+
+    def _register_channel(self, chan, owner=None):
+        with self._channels_lock:
+            self._channels.setdefault(owner or threading.current_thread(), set()).add(chan)
+
+    def _unregister_channel(self, chan, owner=None):
+        with self._channels_lock:
+            owner = owner or threading.current_thread()
+            channels = self._channels.get(owner, set())
+            channels.discard(chan)
+            if not channels:
+                self._channels.pop(owner, None)
+
+    def _open_session(self):
+        chan = self.client.get_transport().open_session()
+        self._register_channel(chan)
+        return chan
+
+    def _open_sftp(self, owner=None):
+        sftp = self._pop_idle_sftp()
+        if sftp is None:
+            sftp = self.client.open_sftp()
+        self._register_channel(sftp.get_channel(), owner)
+        return sftp
+
+    def _pop_idle_sftp(self):
+        with self._channels_lock:
+            while self._idle_sftp:
+                sftp = self._idle_sftp.pop()
+                if not sftp.get_channel().closed:
+                    return sftp
+        return None
+
+    def _close_sftp(self, sftp, reuse=True, owner=None):
+        """
+        Keeps _sftp_ open for the next file operation if _reuse_ is True
+        and there is room in the idle sessions, otherwise closes it.
+        """
+        self._unregister_channel(sftp.get_channel(), owner)
+        if reuse and not sftp.get_channel().closed:
+            sftp.chdir(None)
+            with self._channels_lock:
+                if len(self._idle_sftp) < SSHClient.MAX_IDLE_SFTP_SESSIONS:
+                    self._idle_sftp.append(sftp)
+                    return
+        sftp.close()
+
+    @contextlib.contextmanager
+    def _sftp_session(self):
+        sftp = self._open_sftp()
+        try:
+            yield sftp
+        except BaseException:
+            self._close_sftp(sftp, reuse=False)
+            raise
+        self._close_sftp(sftp)
+
+    def is_alive(self):
+        transport = self.client.get_transport() if self.client else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore(1)
+        except Exception:  # pylint: disable=broad-except; noqa: W0703
+            return False
+        return True
+
     def get_scp_client(self):
         return SCPClient(self.client.get_transport())
 
-    def execute_command(self, command):
-        chan = self.client.get_transport().open_session()
-        chan.settimeout(1.0)
+    def execute_command(self, command, output=None, stdin=None):
+        """
+        Executes _command_ and returns tuple (status, stdout, stderr). If
+        _output_ is given, the command output is written to it as it
+        arrives and the returned stdout and stderr are taken from it.
+
+        If _stdin_ is given, it is called in a separate thread with a
+        binary file object writing to the standard input of the command.
+        The standard input is closed when _stdin_ returns. The command is
+        run without a terminal and without su password handling.
+        """
+        output = OutputCollector() if output is None else output
+        chan = self._open_session()
+        # Sending standard input waits for the remote window, which may
+        # stay full for long while the command is busy.
+        chan.settimeout(1.0 if stdin is None else None)
+        feeder = None
         try:
             # if the command executed with 'sudo' prefix the terminal needed as well
-            if ((self.su_username and self.su_password)
-                    or (re.search("\ssudo\s.*", command, re.IGNORECASE) is not None)):  # noqa: W605
+            if stdin is None and ((self.su_username and self.su_password)
+                                  or (re.search("\ssudo\s.*", command, re.IGNORECASE) is not None)):  # noqa: W605
                 chan.get_pty()
+            ready = self._set_ready_event(chan)
             chan.exec_command(command)
+            if stdin is not None:
+                feeder = _StdinFeeder(chan, stdin)
+                feeder.start()
             while not self.client.get_transport().is_active():
                 time.sleep(0.1)
                 try:
@@ -68,14 +240,14 @@ class SSHClient(SSHClientBase):
                     raise SSHException("Connection closed unexpectedly: " + str(sys.exc_info()[1]))
 
             out = b""
-            err = b""
             password_sent = False
-            if self.su_username and self.su_password:
-                for _ in range(100):
+            if stdin is None and self.su_username and self.su_password:
+                deadline = time.time() + SSHClient.SU_PASSWORD_TIMEOUT
+                while time.time() < deadline:
                     if chan.exit_status_ready() or chan.closed:
                         break
                     if not chan.recv_ready():
-                        time.sleep(0.1)
+                        self._wait_for_channel(chan, ready, deadline - time.time())
                     else:
                         out += chan.recv(SSHClient.BUFFER_SIZE)
                         outmatch = re.match(b".*[P|p]assword:\s*$", out, re.DOTALL)  # noqa: W605
@@ -86,131 +258,466 @@ class SSHClient(SSHClientBase):
                             password_sent = True
                             break
 
-            if password_sent:
-                out = b""
+            if not password_sent and out:
+                output.write(STDOUT, out)
 
-            counter = 0
+            last_keepalive = time.time()
             while self.client.get_transport().is_active():
                 if chan.exit_status_ready() or chan.closed:
                     break
                 if chan.recv_ready():
-                    out += chan.recv(SSHClient.BUFFER_SIZE)
+                    output.write(STDOUT, chan.recv(SSHClient.BUFFER_SIZE))
                 if chan.recv_stderr_ready():
-                    err += chan.recv_stderr(SSHClient.BUFFER_SIZE)
-                counter = (counter + 1) % 10
-                if counter == 0:
+                    output.write(STDERR, chan.recv_stderr(SSHClient.BUFFER_SIZE))
+                if time.time() - last_keepalive >= SSHClient.KEEPALIVE_INTERVAL:
+                    last_keepalive = time.time()
                     try:
                         self.client.get_transport().send_ignore(1)
                     except SSHException:
                         break
-                time.sleep(0.1)
+                self._wait_for_channel(chan, ready, SSHClient.KEEPALIVE_INTERVAL)
 
+            # Exit status is sent after all the output so the output is
+            # already buffered when the exit status is ready.
             while chan.recv_ready():
-                out += chan.recv(SSHClient.BUFFER_SIZE)
-                time.sleep(0.1)
+                output.write(STDOUT, chan.recv(SSHClient.BUFFER_SIZE))
             while chan.recv_stderr_ready():
-                err += chan.recv_stderr(SSHClient.BUFFER_SIZE)
-                time.sleep(0.1)
+                output.write(STDERR, chan.recv_stderr(SSHClient.BUFFER_SIZE))
             stat = Result.UNKNOWN_STATUS
             if chan.exit_status_ready():
                 stat = str(chan.recv_exit_status())  # TBD: Use this as real exit status
                 if stat == '-1':
                     stat = Result.UNKNOWN_STATUS
-            return stat, out, err
         finally:
+            self._unregister_channel(chan)
             chan.close()
+            output.close()
+            if feeder is not None:
+                feeder.join()
+        if feeder is not None and feeder.error is not None:
+            # Writing fails if the command exits before reading all the input
+            if stat == '0' or not isinstance(feeder.error, _StdinClosedError):
+                raise feeder.error
+            debug('Writing standard input failed: %s' % feeder.error)
+        return stat, output.stdout, output.stderr
+
+    @staticmethod
+    def _set_ready_event(chan):
+        """
+        Returns event which is set when stdout or stderr data is available
+        in _chan_, when the channel is closed or when the exit status is
+        received. The exit status may arrive long before the end of file
+        if a background process keeps the output open.
+        """
+        ready = threading.Event()
+        chan.in_buffer.set_event(ready)
+        chan.in_stderr_buffer.set_event(ready)
+        chan.status_event = _StatusEvent(ready)
+        return ready
+
+    @staticmethod
+    def _wait_for_channel(chan, ready, timeout):
+        if chan.recv_ready() or chan.recv_stderr_ready() or chan.exit_status_ready():
+            return
+        if chan.eof_received:
+            chan.status_event.wait(timeout)
+        else:
+            ready.wait(timeout)
 
-    def put_file(self, src_file, dst_dir, mode):
+    def put_file(self, src_file, dst_dir, mode, chunked=None, resume=False):
+        """
+        Copies local _src_file_ to remote directory _dst_dir_. If
+        _chunked_ applies to the size of the file, byte ranges of the file
+        are written in parallel over several SFTP sessions. If _resume_ is
+        True and the remote file is a partial copy of _src_file_, only the
+        rest of the file is written.
+        """
         src_file.replace('/', os.sep)
         mode = int(mode, 8)
-        sftp = self.client.open_sftp()
-        try:
+        with self._sftp_session() as sftp:
             dst_dir = self._resolve_dir(sftp, dst_dir)
-            self._create_missing_dirs(sftp, dst_dir)
             dst_file = posixpath.join(dst_dir, os.path.basename(src_file))
+            size = os.path.getsize(src_file)
+            offset = self._get_resume_offset(sftp, dst_file, src_file, True) if resume else 0
+            if offset:
+                operation = lambda: self._put_resumed(sftp, src_file, dst_file, offset, size)  # noqa: E731
+            elif chunked is not None and chunked.applies(size):
+                operation = lambda: self._put_chunked(sftp, src_file, dst_file, size, chunked)  # noqa: E731
+            else:
+                operation = lambda: sftp.put(src_file, dst_file)  # noqa: E731
             try:
-                sftp.put(src_file, dst_file)
+                self._in_dir(sftp, dst_dir, operation)
             except Exception as e:
                 raise Exception("Putting file failed (%s/%s): %s" % (dst_dir, src_file, e))
             sftp.chmod(dst_file, mode)
-        finally:
-            sftp.close()
 
-    @staticmethod
-    def _create_missing_dirs(sftp, dst_dir):
-        if dst_dir[0] == '/':
-            sftp.chdir('/')
-        for d in dst_dir.split('/'):
-            sftp_working_directory = sftp.getcwd()
-            if (d and d != '.' and d != '..' and
-                    d not in sftp.listdir(sftp_working_directory)):
-                debug("Creating remote directory (%s/%s)" % (sftp_working_directory, d))
-                try:
-                    sftp.mkdir(d)
-                except Exception as e:
-                    raise Exception(
-                        'Cannot create directory "%s" under "%s" in the remote host: %s'
-                        % (d, sftp_working_directory, e))
+    def _create_missing_dirs(self, sftp, dst_dir):
+        """
+        Creates the missing directories of absolute path _dst_dir_.
+
+        *Returns:*\n
+        True if _dst_dir_ was known to exist without asking the remote host.
+        """
+        dst_dir = posixpath.normpath(dst_dir)
+        if dst_dir in self._known_dirs:
+            return True
+        missing = list()
+        directory = dst_dir
+        while directory != '/' and directory not in self._known_dirs:
             try:
-                sftp.chdir(d)
+                sftp.stat(directory)
+                break
+            except IOError:
+                missing.append(directory)
+                directory = posixpath.dirname(directory)
+        for directory in reversed(missing):
+            debug("Creating remote directory (%s)" % directory)
+            try:
+                sftp.mkdir(directory)
             except Exception as e:
+                if self._is_dir(sftp, directory):
+                    # Created concurrently over another channel
+                    continue
                 raise Exception(
-                    'Cannot cd to newly created directory "%s" under "%s" in the remote host: %s'
-                    % (d, sftp_working_directory, e))
+                    'Cannot create directory "%s" under "%s" in the remote host: %s'
+                    % (posixpath.basename(directory), posixpath.dirname(directory), e))
+        directory = dst_dir
+        while directory != '/':
+            self._known_dirs.add(directory)
+            directory = posixpath.dirname(directory)
+        return False
 
-    def get_file(self, src_file, dst_file):
-        sftp = self.client.open_sftp()
+    @staticmethod
+    def _is_dir(sftp, path):
         try:
+            return S_ISDIR(sftp.stat(path).st_mode)
+        except IOError:
+            return False
+
+    def _in_dir(self, sftp, dst_dir, operation):
+        """
+        Creates missing _dst_dir_ and calls _operation_. If _dst_dir_ was
+        cached but it has been removed from the remote host, it is
+        created again and _operation_ is retried.
+        """
+        cached = self._create_missing_dirs(sftp, dst_dir)
+        try:
+            return operation()
+        except IOError as e:
+            if not cached or e.errno != errno.ENOENT:
+                raise
+        self.forget_dirs()
+        self._create_missing_dirs(sftp, dst_dir)
+        return operation()
+
+    def _put_chunked(self, sftp, src_file, dst_file, size, chunked):
+        with contextlib.closing(sftp.open(dst_file, 'wb')):
+            pass
+        self._run_chunked(chunked, size, lambda session, offset, length: self._put_range(
+            session, src_file, dst_file, offset, length))
+        self._verify_copy(sftp, dst_file, src_file)
+
+    def _put_resumed(self, sftp, src_file, dst_file, offset, size):
+        self._put_range(sftp, src_file, dst_file, offset, size - offset)
+        self._verify_copy(sftp, dst_file, src_file)
+
+    @staticmethod
+    def _put_range(sftp, src_file, dst_file, offset, length):
+        with open(src_file, 'rb') as from_fd:
+            with contextlib.closing(sftp.open(dst_file, 'r+b')) as to_fd:
+                to_fd.set_pipelined(True)
+                from_fd.seek(offset)
+                to_fd.seek(offset)
+                while length > 0:
+                    data = from_fd.read(min(SSHClient.BUFFER_SIZE, length))
+                    if not data:
+                        raise IOError('File "%s" was truncated during transfer' % src_file)
+                    to_fd.write(data)
+                    length -= len(data)
+
+    def get_file(self, src_file, dst_file, chunked=None, resume=False):
+        """
+        Copies remote _src_file_ to local _dst_file_. If _chunked_ applies
+        to the size of the file, byte ranges of the file are read in
+        parallel over several SFTP sessions. If _resume_ is True and
+        _dst_file_ is a partial copy of _src_file_, only the rest of the
+        file is read.
+        """
+        with self._sftp_session() as sftp:
             dst_file = os.path.abspath(dst_file.replace('/', os.sep))
             dst_dir = os.path.dirname(dst_file)
             if not os.path.exists(dst_dir):
                 os.makedirs(dst_dir)
-            sftp.get(src_file, dst_file)
-        finally:
-            sftp.close()
+            offset = self._get_resume_offset(sftp, src_file, dst_file, False) if resume else 0
+            size = sftp.stat(src_file).st_size if chunked is not None or offset else 0
+            if offset:
+                self._get_range(sftp, src_file, dst_file, offset, size - offset)
+                self._verify_copy(sftp, src_file, dst_file)
+            elif chunked is not None and chunked.applies(size):
+                self._get_chunked(sftp, src_file, dst_file, size, chunked)
+            else:
+                sftp.get(src_file, dst_file)
 
-    def copy_file(self, src_file, to_fd):
-        sftp = self.client.open_sftp()
-        from_fd = None
+    def _get_chunked(self, sftp, src_file, dst_file, size, chunked):
+        with open(dst_file, 'wb') as to_fd:
+            to_fd.truncate(size)
+        self._run_chunked(chunked, size, lambda session, offset, length: self._get_range(
+            session, src_file, dst_file, offset, length))
+        self._verify_copy(sftp, src_file, dst_file)
+
+    @staticmethod
+    def _get_range(sftp, src_file, dst_file, offset, length):
+        if length <= 0:
+            return
+        end = offset + length
+        with contextlib.closing(sftp.open(src_file, 'rb')) as from_fd:
+            with open(dst_file, 'r+b') as to_fd:
+                to_fd.seek(offset)
+                # Prefetched responses are buffered, so request one window at a time
+                for start in range(offset, end, SSHClient.COPY_WINDOW):
+                    window_end = min(start + SSHClient.COPY_WINDOW, end)
+                    for data in from_fd.readv([(o, min(SSHClient.BUFFER_SIZE, window_end - o))
+                                               for o in range(start, window_end, SSHClient.BUFFER_SIZE)]):
+                        to_fd.write(data)
+
+    def _run_chunked(self, chunked, size, transfer_range):
+        """
+        Runs _chunked_ transfer of _size_ bytes. The SFTP sessions of the
+        transfer threads are owned by the calling thread so that they are
+        closed if the execution is interrupted.
+        """
+        owner = threading.current_thread()
+        chunked.run(size, lambda: self._open_sftp(owner),
+                    lambda session, failed: self._close_sftp(session, not failed, owner),
+                    transfer_range)
+
+    def _get_resume_offset(self, sftp, remote_file, local_file, upload):
+        """
+        Returns the size of the partial destination file if it is not
+        larger than the source file and its content equals the beginning
+        of the source file, otherwise 0. The destination is _remote_file_
+        if _upload_ is True and _local_file_ otherwise.
+        """
         try:
-            from_fd = sftp.open(src_file, 'rb')
-            file_to_size = 0
-            file_from_stat = from_fd.stat()
-            while True:
-                data = from_fd.read(SSHClient.BUFFER_SIZE)
+            remote_size = sftp.stat(remote_file).st_size
+        except IOError:
+            return 0
+        local_size = os.path.getsize(local_file) if os.path.isfile(local_file) else 0
+        offset, size = (remote_size, local_size) if upload else (local_size, remote_size)
+        if not 0 < offset <= size:
+            return 0
+        remote_digest = self._get_remote_md5(remote_file, offset)
+        if remote_digest is None or remote_digest != self._get_local_md5(local_file, offset):
+            debug('Not resuming transfer of "%s": partial copy differs' % remote_file)
+            return 0
+        debug('Resuming transfer of "%s" at byte %d of %d' % (remote_file, offset, size))
+        return offset
+
+    def _verify_copy(self, sftp, remote_file, local_file):
+        """
+        Compares the size and, if md5sum is available in the remote host,
+        the MD5 checksum of _remote_file_ and _local_file_.
+        """
+        remote_size = sftp.stat(remote_file).st_size
+        local_size = os.path.getsize(local_file)
+        if remote_size != local_size:
+            raise IOError('Size mismatch in copying:  %d != %d' % (local_size, remote_size))
+        remote_digest = self._get_remote_md5(remote_file)
+        if remote_digest is None:
+            debug('Skipping checksum verification of "%s": md5sum failed' % remote_file)
+            return
+        if remote_digest != self._get_local_md5(local_file):
+            raise IOError('Checksum mismatch in copying "%s"' % remote_file)
+
+    def _get_remote_md5(self, path, length=None):
+        """
+        Returns MD5 checksum of the first _length_ bytes or the whole of
+        remote file _path_, or None if it cannot be computed in the remote
+        host.
+        """
+        if length is None:
+            command = 'md5sum -- ' + shell_quote(path)
+        else:
+            command = 'head -c %d -- %s | md5sum' % (length, shell_quote(path))
+        status, stdout, _ = self.execute_command(command, stdin=lambda fileobj: None)
+        if status != '0' or not stdout.strip():
+            return None
+        return to_string(stdout).split()[0]
+
+    @staticmethod
+    def _get_local_md5(path, length=None):
+        digest = hashlib.md5()
+        remaining = os.path.getsize(path) if length is None else length
+        with open(path, 'rb') as fileobj:
+            while remaining > 0:
+                data = fileobj.read(min(1024 * 1024, remaining))
                 if not data:
                     break
+                digest.update(data)
+                remaining -= len(data)
+        return digest.hexdigest()
+
+    def copy_file(self, src_file, to_fd, window=None):
+        """
+        Copies _src_file_ to remote file _to_fd_. At most _window_ bytes
+        are requested from the source ahead of the writes and the writes
+        are pipelined without waiting for each acknowledgement.
+        """
+        window = max(int(window or SSHClient.COPY_WINDOW), SSHClient.BUFFER_SIZE)
+        with self._sftp_session() as sftp:
+            with contextlib.closing(sftp.open(src_file, 'rb')) as from_fd:
+                file_from_size = from_fd.stat().st_size
+                to_fd.set_pipelined(True)
+                file_to_size = self._relay(from_fd, file_from_size, to_fd, window)
+        if file_from_size != file_to_size:
+            raise IOError('Size mismatch in copying:  %d != %d' % (
+                file_from_size, file_to_size))
+
+    @staticmethod
+    def _relay(from_fd, size, to_fd, window):
+        """
+        Writes _size_ bytes of _from_fd_ to _to_fd_ while a separate
+        thread reads the following ones. Returns the number of bytes
+        written.
+        """
+        chunks = queue.Queue(window // SSHClient.BUFFER_SIZE)
+        errors = list()
+        stopped = threading.Event()
+
+        def read():
+            try:
+                for offset in range(0, size, window):
+                    end = min(offset + window, size)
+                    for data in from_fd.readv([(o, min(SSHClient.BUFFER_SIZE, end - o))
+                                               for o in range(offset, end, SSHClient.BUFFER_SIZE)]):
+                        if stopped.is_set():
+                            return
+                        chunks.put(data)
+            except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+                errors.append(e)
+            finally:
+                chunks.put(None)
+
+        reader = threading.Thread(target=read, name='RemoteScriptCopyReader')
+        reader.daemon = True
+        reader.start()
+        copied = 0
+        try:
+            for data in iter(chunks.get, None):
                 to_fd.write(data)
-                file_to_size += len(data)
+                copied += len(data)
         finally:
-            if from_fd:
-                from_fd.close()
-            sftp.close()
-        if file_from_stat.st_size != file_to_size:
-            raise IOError('Size mismatch in copying:  %d != %d' % (
-                file_from_stat.st_size, file_to_size))
+            stopped.set()
+            while reader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+        if errors:
+            raise errors[0]
+        return copied
+
+    @staticmethod
+    def generate_key(comment):
+        """
+        Generates new ECDSA key and returns tuple (private key in PEM
+        format, public key line for authorized_keys ending with _comment_).
+        """
+        key = paramiko.ECDSAKey.generate()
+        private_key = StringIO()
+        key.write_private_key(private_key)
+        return private_key.getvalue(), '%s %s %s' % (key.get_name(), key.get_base64(), comment)
 
     def get_remote_fd(self, directory, filename):
-        sftp = self.client.open_sftp()
-        directory = self._resolve_dir(sftp, directory)
-        self._create_missing_dirs(sftp, directory)
-        file_path = posixpath.join(directory, filename)
-        fd = sftp.open(file_path, 'wb')
-        return SFTPRemoteFile(sftp, fd)
+        sftp = self._open_sftp()
+        try:
+            directory = self._resolve_dir(sftp, directory)
+            file_path = posixpath.join(directory, filename)
+            fd = self._in_dir(sftp, directory, lambda: sftp.open(file_path, 'wb'))
+        except BaseException:
+            self._close_sftp(sftp, reuse=False)
+            raise
+        return SFTPRemoteFile(sftp, fd, self._close_sftp)
+
+
+def _supports_transport_factory():
+    # SSHClient.connect accepts transport_factory since paramiko 3.2
+    version = tuple(int(v) for v in re.findall(r'\d+', paramiko.__version__)[:2])
+    return version >= (3, 2)
+
+
+# threading.Event is a factory function in Python 2
+class _StatusEvent(getattr(threading, '_Event', threading.Event)):
+    """
+    Exit status event of a channel which also sets event _ready_.
+    """
+
+    def __init__(self, ready):
+        super(_StatusEvent, self).__init__()
+        self._ready = ready
+
+    def set(self):
+        super(_StatusEvent, self).set()
+        self._ready.set()
+
+
+class _StdinClosedError(Exception):
+    pass
+
+
+class _StdinWriter(object):
+
+    def __init__(self, chan):
+        self._chan = chan
+
+    def write(self, data):
+        try:
+            self._chan.sendall(data)
+        except (EOFError, socket.error) as e:
+            # Only the command closing its input is expected
+            if isinstance(e, EOFError) or self._chan.closed or self._chan.eof_received:
+                raise _StdinClosedError(str(e))
+            raise
+
+    def flush(self):
+        pass
+
+
+class _StdinFeeder(threading.Thread):
+
+    def __init__(self, chan, stdin):
+        super(_StdinFeeder, self).__init__()
+        self.daemon = True
+        self.error = None
+        self._chan = chan
+        self._stdin = stdin
+
+    def run(self):
+        try:
+            self._stdin(_StdinWriter(self._chan))
+            self._chan.shutdown_write()
+        except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+            self.error = e
+            self._chan.close()
 
 
 class SFTPRemoteFile(RemoteFile):
 
-    def __init__(self, sftp, fd):
+    def __init__(self, sftp, fd, close_sftp):
         self._sftp = sftp
         self._fd = fd
+        self._close_sftp = close_sftp
 
     def write(self, data):
         self._fd.write(data)
 
+    def set_pipelined(self, pipelined):
+        self._fd.set_pipelined(pipelined)
+
     def chmod(self, mode):
         self._fd.chmod(mode)
 
     def close(self):
         self._fd.close()
-        self._sftp.close()
+        self._close_sftp(self._sftp)
@@ -14,6 +14,7 @@ from com.trilead.ssh2 import (
 import jarray
 from java.io import BufferedReader, InputStreamReader, FileOutputStream, IOException
 # pylint: enable=import-error
+from .output import STDOUT, STDERR
 from .remotefile import RemoteFile
 from .result import Result
 from .SSHClientBase import (
@@ -46,7 +47,7 @@ class SSHClient(SSHClientBase):
     def get_scp_client(self):
         return SCPClient(self.client)
 
-    def execute_command(self, command):
+    def execute_command(self, command, output=None):
         chan = self.client.openSession()
         try:
             if self.su_username and self.su_password:
@@ -105,6 +106,11 @@ class SSHClient(SSHClientBase):
                 stat = Result.UNKNOWN_STATUS
             else:
                 stat = str(stat)
+            if output is not None:
+                output.write(STDOUT, out)
+                output.write(STDERR, err)
+                output.close()
+                return stat, output.stdout, output.stderr
             return stat, out, err
         finally:
             chan.close()
@@ -118,7 +124,7 @@ class SSHClient(SSHClientBase):
             line = reader.readLine()
         return lines
 
-    def put_file(self, src_file, dst_dir, mode):
+    def put_file(self, src_file, dst_dir, mode, chunked=None, resume=False):  # pylint: disable=unused-argument
         src_file.replace('/', os.sep)
         mode = int(mode, 8)
         sftp = SFTPv3Client(self.client)
@@ -159,7 +165,7 @@ class SSHClient(SSHClientBase):
             except IOException:
                 sftp.mkdir(curdir, 0o744)
 
-    def get_file(self, src_file, dst_file):
+    def get_file(self, src_file, dst_file, chunked=None, resume=False):  # pylint: disable=unused-argument
         sftp = SFTPv3Client(self.client)
         dst_fd = None
         src_fd = None
@@ -192,7 +198,7 @@ class SSHClient(SSHClientBase):
                 dst_fd.close()
             sftp.close()
 
-    def copy_file(self, src_file, to_fd):
+    def copy_file(self, src_file, to_fd, window=None):
         sftp = SFTPv3Client(self.client)
         from_fd = None
         try:
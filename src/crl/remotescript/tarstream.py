@@ -0,0 +1,208 @@
+import copy
+import gzip
+import os
+import tarfile
+import threading
+from logging import debug
+from crl.remotescript.output import BoundedOutputCollector, STDOUT
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+# Python versions with extraction filters warn if the filter is not given
+_EXTRACT_ARGS = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+
+def write_tree(fileobj, source_dir, mode, compress=False, paths=None, compress_level=9):
+    """
+    Writes tar archive of the directories and files under _source_dir_
+    to _fileobj_ as a stream.
+
+    The members are named relative to _source_dir_ and they get
+    permissions _mode_ and root ownership. Symbolic links to files are
+    archived as the files they point to and symbolic links to
+    directories as empty directories. If _compress_ is True, the
+    archive is gzip compressed with _compress_level_. If _paths_ is
+    given, only the files whose member names are in _paths_ are
+    archived.
+    """
+    gzip_file = None
+    if compress:
+        gzip_file = fileobj = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=int(compress_level))
+    tar = tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.GNU_FORMAT, dereference=True)
+    try:
+        for root, dirs, files in os.walk(source_dir):
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                arcname = os.path.relpath(path, source_dir).replace(os.sep, '/')
+                if paths is not None and arcname not in paths:
+                    continue
+                info = _get_tarinfo(tar, path, arcname, mode)
+                if info.isreg():
+                    with open(path, 'rb') as f:
+                        tar.addfile(info, f)
+                elif info.isdir():
+                    tar.addfile(info)
+    finally:
+        tar.close()
+        if gzip_file is not None:
+            gzip_file.close()
+
+
+def _get_tarinfo(tar, path, arcname, mode):
+    info = tar.gettarinfo(path, arcname)
+    info.mode = mode
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+class ExtractingOutput(object):
+    """
+    Output sink extracting tar archive written to stdout of a remote
+    command into local directory _destination_dir_ as it arrives.
+
+    The archive is extracted in a separate thread. At most _max_queued_
+    chunks of the archive are buffered so the memory usage does not
+    depend on the archive size and slow extraction throttles the remote
+    command. Standard error is collected up to _max_stderr_ bytes.
+    Extraction failure is stored in _error_ and the rest of the archive
+    is discarded.
+    """
+
+    def __init__(self, destination_dir, max_queued=16, max_stderr=65536):
+        self.error = None
+        self._queue = queue.Queue(max_queued)
+        self._stderr = BoundedOutputCollector(max_stderr)
+        self._thread = threading.Thread(target=self._extract, args=(destination_dir,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, stream, data):
+        if stream == STDOUT:
+            if data:
+                self._queue.put(data)
+        else:
+            self._stderr.write(stream, data)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _extract(self, destination_dir):
+        reader = _QueueReader(self._queue)
+        try:
+            extract_tree(reader, destination_dir)
+        except Exception as e:  # pylint: disable=broad-except; noqa: W0703
+            self.error = e
+        finally:
+            reader.discard()
+
+    stdout = b''
+
+    @property
+    def stderr(self):
+        return self._stderr.stderr
+
+    @property
+    def truncated(self):
+        return self._stderr.truncated
+
+
+class _QueueReader(object):
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def discard(self):
+        while not self._eof:
+            self._fill()
+            self._buffer = b''
+
+    def _fill(self):
+        data = self._chunks.get()
+        if data is None:
+            self._eof = True
+        else:
+            self._buffer += data
+
+
+def extract_tree(fileobj, destination_dir):
+    """
+    Extracts tar archive stream read from _fileobj_ to
+    _destination_dir_.
+
+    The archive may be gzip compressed. Members with absolute names or
+    names and links pointing outside _destination_dir_ are refused with
+    _ValueError_. Devices and other special files are skipped. The
+    extracted files are owned by the local user instead of the owners
+    recorded in the archive.
+    """
+    tar = tarfile.open(fileobj=fileobj, mode='r|*')
+    try:
+        if not os.path.isdir(destination_dir):
+            os.makedirs(destination_dir)
+        root = os.path.realpath(destination_dir)
+        directories = []
+        for member in tar:
+            if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+                debug('Skipping special file "%s"' % member.name)
+                continue
+            _check_member(member, root)
+            member.uid, member.gid = _local_owner()
+            member.uname = member.gname = ''
+            if member.isdir():
+                # Permissions are set after the contents are extracted
+                # so that read-only directories can be filled.
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0o700
+            tar.extract(member, root, **_EXTRACT_ARGS)
+    finally:
+        tar.close()
+    for member in reversed(directories):
+        path = os.path.join(root, member.name)
+        os.chmod(path, member.mode & 0o777)
+        os.utime(path, (member.mtime, member.mtime))
+
+
+def _check_member(member, root):
+    path = _resolve(root, member.name)
+    if member.issym():
+        _resolve(root, os.path.join(os.path.dirname(member.name), member.linkname), member.name)
+    elif member.islnk():
+        _resolve(root, member.linkname, member.name)
+    if path == root and not member.isdir():
+        raise ValueError('Refusing to extract "%s": not a directory' % member.name)
+
+
+def _resolve(root, name, member_name=None):
+    if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        raise ValueError('Refusing to extract "%s": absolute path' % (member_name or name))
+    path = os.path.realpath(os.path.join(root, name))
+    if path != root and not path.startswith(root.rstrip(os.sep) + os.sep):
+        raise ValueError('Refusing to extract "%s": path outside destination' % (member_name or name))
+    return path
+
+
+def _local_owner():
+    if hasattr(os, 'geteuid'):
+        return os.geteuid(), os.getegid()
+    return 0, 0
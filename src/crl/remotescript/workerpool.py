@@ -0,0 +1,100 @@
+import threading
+from logging import debug
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+class WorkerPool(object):
+    """
+    Pool of reusable worker threads running submitted jobs.
+
+    At most _max_workers_ threads are started. Jobs submitted while all
+    the workers are busy wait in the queue and `submit` blocks when
+    _max_queued_ jobs are already waiting. Idle workers exit after
+    _idle_timeout_ seconds. After `shutdown` new workers are started
+    again for the jobs submitted later.
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_workers, max_queued, idle_timeout=60):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_queued)
+        self._max_workers = max_workers
+        self._idle_timeout = idle_timeout
+        self._workers = 0
+        self._idle = 0
+        self._stopping = 0
+        self._counter = 0
+
+    def resize(self, max_workers, max_queued):
+        with self._lock:
+            self._max_workers = max_workers
+            self._queue.maxsize = max_queued
+
+    def submit(self, job, block=True):
+        """
+        Queues _job_ for execution. _job_ must have run method which is
+        called in a worker thread. Blocks while the queue is full or, if
+        _block_ is False, raises _queue.Full_.
+        """
+        self._queue.put(job, block)
+        with self._lock:
+            # Stopping workers take the stop markers in the queue
+            available = max(self._idle - self._stopping, 0)
+            if (available < self._queue.qsize() - self._stopping and
+                    self._workers - self._stopping < self._max_workers):
+                self._start_worker()
+
+    def shutdown(self):
+        """
+        Stops the workers after the queued jobs have been run. Workers
+        that would have to wait for room in a full queue are left to
+        exit when they have been idle long enough.
+        """
+        with self._lock:
+            for _ in range(self._workers - self._stopping):
+                try:
+                    self._queue.put_nowait(self._STOP)
+                except queue.Full:
+                    break
+                self._stopping += 1
+
+    def _start_worker(self):
+        self._workers += 1
+        self._counter += 1
+        worker = threading.Thread(target=self._work, name='RemoteScriptWorker-%d' % self._counter)
+        worker.daemon = True
+        worker.start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            try:
+                job = self._queue.get(timeout=self._idle_timeout)
+            except queue.Empty:
+                job = None
+            with self._lock:
+                self._idle -= 1
+                if job is self._STOP:
+                    self._stopping -= 1
+                if job is self._STOP or (job is None and not self._queue.qsize()):
+                    self._workers -= 1
+                    return
+            if job is None:
+                continue
+            try:
+                job.run()
+            except Exception:  # pylint: disable=broad-except; noqa: W0703
+                debug('Worker job failed')
+            with self._lock:
+                if self._workers > self._max_workers:
+                    self._workers -= 1
+                    return
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from crl.remotescript.chunkedtransfer import ChunkedTransfer
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+@pytest.mark.parametrize('threshold, channels, size, expected', [
+    (10, 4, 10, True),
+    (10, 4, 9, False),
+    (0, 4, 10, False),
+    (10, 1, 10, False)])
+def test_applies(threshold, channels, size, expected):
+    assert ChunkedTransfer(threshold, 4, channels).applies(size) == expected
+
+
+def test_run_transfers_all_chunks():
+    lock = threading.Lock()
+    ranges = []
+    closed = []
+
+    def transfer_range(session, offset, length):
+        with lock:
+            ranges.append((offset, length))
+
+    ChunkedTransfer(1, 3, 2).run(
+        10, object, lambda session, failed: closed.append(failed), transfer_range)
+
+    assert sorted(ranges) == [(0, 3), (3, 3), (6, 3), (9, 1)]
+    assert closed == [False, False]
+
+
+def test_run_raises_transfer_error():
+    closed = []
+
+    def transfer_range(session, offset, length):
+        if offset == 3:
+            raise IOError('write failed')
+
+    with pytest.raises(IOError):
+        ChunkedTransfer(1, 3, 2).run(
+            10, object, lambda session, failed: closed.append(failed), transfer_range)
+    assert True in closed
@@ -0,0 +1,111 @@
+# pylint: disable=redefined-outer-name
+import pytest
+import mock
+
+from crl.remotescript.connectionpool import ConnectionPool
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+@pytest.fixture(scope='function')
+def pool():
+    p = ConnectionPool()
+    yield p
+    p.close()
+
+
+def create_connection(alive=True):
+    connection = mock.Mock()
+    connection.is_alive.return_value = alive
+    return connection
+
+
+def test_acquire_returns_released_connection(pool):
+    connection = create_connection()
+    pool.add('key', connection, 60)
+    assert pool.acquire('key', 60) is None
+    assert pool.release(connection)
+    assert pool.acquire('key', 60) is connection
+    assert pool.acquire('other', 60) is None
+
+
+def test_release_unknown_connection(pool):
+    assert not pool.release(create_connection())
+
+
+def test_dead_connection_is_closed(pool):
+    connection = create_connection()
+    pool.add('key', connection, 60)
+    pool.release(connection)
+    connection.is_alive.return_value = False
+    assert pool.acquire('key', 60) is None
+    connection.close_connection.assert_called_once_with()
+
+
+def test_expired_connection_is_closed(pool):
+    connection = create_connection()
+    pool.add('key', connection, 0)
+    with mock.patch('crl.remotescript.connectionpool.time.time', return_value=0):
+        pool.release(connection)
+    assert pool.acquire('key', 0) is None
+    connection.close_connection.assert_called_once_with()
+
+
+def test_close_closes_all_connections(pool):
+    connections = [create_connection() for _ in range(3)]
+    for connection in connections:
+        pool.add('key', connection, 60)
+    pool.close()
+    for connection in connections:
+        connection.close_connection.assert_called_once_with()
+
+
+def test_connection_is_shared_up_to_max_leases(pool):
+    connection = create_connection()
+    pool.add('key', connection, 60)
+    assert pool.acquire('key', 60, max_leases=2) is connection
+    assert pool.acquire('key', 60, max_leases=2) is None
+    pool.cancel('key')
+
+
+def test_zero_ttl_connection_is_closed_after_last_release(pool):
+    connection = create_connection()
+    pool.add('key', connection, 0)
+    assert pool.acquire('key', 0, max_leases=2) is connection
+    pool.release(connection)
+    assert not connection.close_connection.called
+    pool.release(connection)
+    connection.close_connection.assert_called_once_with()
+    assert not pool.owns(connection)
+
+
+def test_expire_closes_idle_and_released_connections(pool):
+    idle = create_connection()
+    leased = create_connection()
+    pool.add('key', idle, 60)
+    pool.release(idle)
+    pool.add('key', leased, 60)
+
+    pool.expire('key')
+
+    idle.close_connection.assert_called_once_with()
+    assert not leased.close_connection.called
+    pool.release(leased)
+    leased.close_connection.assert_called_once_with()
+
+
+def test_parent_connection_is_leased_while_child_is_pooled(pool):
+    parent = create_connection()
+    child = create_connection()
+    pool.add('key', parent, 0)
+    pool.add('child', child, 60, parent=parent)
+    pool.release(parent)
+    assert not parent.close_connection.called
+
+    pool.expire('child')
+    pool.release(child)
+
+    child.close_connection.assert_called_once_with()
+    parent.close_connection.assert_called_once_with()
+    assert not pool.owns(parent)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import gc
+import threading
+import time
+import mock
+import pytest
+
+from crl.remotescript.output import (
+    BoundedOutputCollector,
+    OutputCollector,
+    OutputStream,
+    SpilledOutput,
+    SpillingOutputCollector,
+    StreamingOutput)
+from crl.remotescript.result import Result
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+def test_output_collector():
+    output = OutputCollector()
+    for data in [b'foo', b'bar']:
+        output.write('stdout', data)
+    output.write('stderr', b'err')
+    assert output.stdout == b'foobar'
+    assert output.stderr == b'err'
+
+
+def test_bounded_output_collector_keeps_head_and_tail():
+    output = BoundedOutputCollector(6)
+    for data in [b'ab', b'cdef', b'ghij', b'k']:
+        output.write('stdout', data)
+    output.write('stderr', b'err')
+    assert output.stdout == b'abcijk'
+    assert output.truncated == {'stdout': 5, 'stderr': 0}
+    assert output.stderr == b'err'
+
+
+def test_spilling_output_collector(tmpdir):
+    output = SpillingOutputCollector(4, str(tmpdir))
+    for data in [b'abc', b'def', b'ghi']:
+        output.write('stdout', data)
+    output.write('stderr', b'err')
+    output.close()
+    assert output.stderr == b'err'
+    assert isinstance(output.stdout, SpilledOutput)
+    assert output.stdout.size == 9
+    result = Result('0', output.stdout, output.stderr, Result.OPEN_OK, Result.CLOSE_OK)
+    assert result.stdout == 'abcdefghi'
+    assert result.stdout_file == output.stdout.path
+    assert result.stderr_file is None
+
+
+@pytest.mark.parametrize('lines, expected', [
+    (False, [('stdout', u'a\nb'), ('stdout', u'ä\r\nc')]),
+    (True, [('stdout', u'a'), ('stdout', u'bä'), ('stdout', u'c')])])
+def test_streaming_output(lines, expected):
+    calls = []
+    output = StreamingOutput(lambda stream, text: calls.append((stream, text)), lines)
+    data = u'ä'.encode('utf-8')
+    output.write('stdout', b'a\nb' + data[:1])
+    output.write('stdout', data[1:] + b'\r\nc')
+    output.close()
+    assert calls == expected
+    assert output.stdout == b''
+
+
+def test_output_stream():
+    def execute(output):
+        output.write('stderr', b'foo\nbar\n')
+        output.close()
+        return 'result'
+
+    stream = OutputStream(execute, lines=True)
+    assert list(stream) == [('stderr', u'foo'), ('stderr', u'bar')]
+    assert stream.result == 'result'
+
+
+def test_output_stream_raises_execution_error():
+    def execute(output):
+        raise ValueError('foo')
+
+    with pytest.raises(ValueError):
+        list(OutputStream(execute))
+
+
+def _create_endless_execute(written, stopped):
+    def execute(output):
+        try:
+            while True:
+                output.write('stdout', b'x')
+                written.append(1)
+        finally:
+            stopped.set()
+    return execute
+
+
+def test_output_stream_close_stops_bounded_execution():
+    written = []
+    stopped = threading.Event()
+    stream = OutputStream(_create_endless_execute(written, stopped), max_queued=2)
+
+    assert next(stream) == ('stdout', u'x')
+    time.sleep(0.1)
+    assert len(written) < 5
+    stream.close()
+
+    assert stopped.is_set()
+    assert list(stream) == []
+
+
+def test_abandoned_output_stream_stops_execution():
+    stopped = threading.Event()
+    interrupt = mock.Mock()
+    stream = OutputStream(_create_endless_execute([], stopped), max_queued=2, interrupt=interrupt)
+    next(stream)
+
+    del stream
+    gc.collect()
+
+    assert stopped.wait(5)
+    interrupt.assert_called_once_with()
+
+
+def test_finished_output_stream_does_not_interrupt():
+    interrupt = mock.Mock()
+    stream = OutputStream(lambda output: output.write('stdout', b'x'), interrupt=interrupt)
+    assert list(stream) == [('stdout', u'x')]
+
+    stream.close()
+    del stream
+    gc.collect()
+
+    assert not interrupt.called
@@ -0,0 +1,65 @@
+import io
+import tarfile
+
+import pytest
+
+from crl.remotescript import tarstream
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+@pytest.mark.parametrize('compress, compress_level', [(False, 9), (True, 9), (True, 1)])
+def test_write_tree(tmpdir, compress, compress_level):
+    tmpdir.join('file1').write('content1')
+    tmpdir.mkdir('sub').join('file2').write('content2')
+    tmpdir.mkdir('empty')
+    fileobj = io.BytesIO()
+
+    tarstream.write_tree(fileobj, str(tmpdir), 0o750, compress, compress_level=compress_level)
+
+    fileobj.seek(0)
+    tar = tarfile.open(fileobj=fileobj, mode='r:gz' if compress else 'r:')
+    members = {m.name: m for m in tar.getmembers()}
+    assert sorted(members) == ['empty', 'file1', 'sub', 'sub/file2']
+    assert members['empty'].isdir()
+    assert set(m.mode for m in members.values()) == {0o750}
+    assert set(m.uname for m in members.values()) == {'root'}
+    assert tar.extractfile(members['sub/file2']).read() == b'content2'
+
+
+def test_extracting_output(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.mkdir('sub').join('file').write('content')
+    source.join('sub').chmod(0o500)
+    fileobj = io.BytesIO()
+    tarstream.write_tree(fileobj, str(source), 0o500, compress=True)
+    data = fileobj.getvalue()
+
+    output = tarstream.ExtractingOutput(str(tmpdir.join('dest')), max_queued=1)
+    output.write('stderr', b'err')
+    for i in range(0, len(data), 7):
+        output.write('stdout', data[i:i + 7])
+    output.close()
+
+    assert output.error is None
+    assert output.stderr == b'err'
+    assert tmpdir.join('dest', 'sub', 'file').read() == 'content'
+    assert tmpdir.join('dest', 'sub').stat().mode & 0o777 == 0o500
+
+
+@pytest.mark.parametrize('name, linkname', [('../file', ''), ('link', '/etc/passwd'), ('link', '../x')])
+def test_extract_tree_refuses_paths_outside_destination(tmpdir, name, linkname):
+    fileobj = io.BytesIO()
+    tar = tarfile.open(fileobj=fileobj, mode='w')
+    info = tarfile.TarInfo(name)
+    if linkname:
+        info.type = tarfile.SYMTYPE
+        info.linkname = linkname
+    tar.addfile(info, io.BytesIO())
+    tar.close()
+    fileobj.seek(0)
+
+    with pytest.raises(ValueError):
+        tarstream.extract_tree(fileobj, str(tmpdir.join('dest')))
+    assert not tmpdir.join('file').exists() and not tmpdir.join('dest', 'link').exists()
@@ -0,0 +1,84 @@
+import threading
+
+from crl.remotescript.workerpool import WorkerPool
+
+
+__copyright__ = 'Copyright (C) 2019, Nokia'
+
+
+class _Job(object):
+
+    def __init__(self, release, running):
+        self._release = release
+        self._running = running
+        self.thread = None
+        self.done = threading.Event()
+
+    def run(self):
+        self.thread = threading.current_thread()
+        self._running.release()
+        self._release.wait(5)
+        self.done.set()
+
+
+def test_worker_pool_limits_workers():
+    pool = WorkerPool(2, 0)
+    release = threading.Event()
+    running = threading.Semaphore(0)
+    jobs = [_Job(release, running) for _ in range(5)]
+    for job in jobs:
+        pool.submit(job)
+    for _ in range(2):
+        assert running.acquire(True)
+    assert len([job for job in jobs if job.thread is not None]) == 2
+    release.set()
+    for job in jobs:
+        assert job.done.wait(5)
+    assert len(set(job.thread for job in jobs)) <= 2
+    pool.shutdown()
+
+
+def test_worker_pool_reuses_idle_worker():
+    pool = WorkerPool(10, 0)
+    release = threading.Event()
+    release.set()
+    running = threading.Semaphore(0)
+    jobs = [_Job(release, running) for _ in range(3)]
+    for job in jobs:
+        pool.submit(job)
+        assert job.done.wait(5)
+    assert len(set(job.thread for job in jobs)) == 1
+    pool.shutdown()
+
+
+def test_worker_pool_runs_jobs_submitted_after_shutdown():
+    pool = WorkerPool(1, 0)
+    release = threading.Event()
+    release.set()
+    running = threading.Semaphore(0)
+    first = _Job(release, running)
+    pool.submit(first)
+    assert first.done.wait(5)
+    pool.shutdown()
+
+    job = _Job(release, running)
+    pool.submit(job)
+
+    assert job.done.wait(5)
+    pool.shutdown()
+
+
+def test_worker_pool_shutdown_does_not_block_on_full_queue():
+    pool = WorkerPool(1, 1)
+    release = threading.Event()
+    running = threading.Semaphore(0)
+    jobs = [_Job(release, running) for _ in range(2)]
+    for job in jobs:
+        pool.submit(job)
+    assert running.acquire(True)
+
+    pool.shutdown()
+
+    release.set()
+    for job in jobs:
+        assert job.done.wait(5)